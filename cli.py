@@ -0,0 +1,110 @@
+"""
+Command line interface for maintenance operations on the vector database.
+
+Usage:
+    python cli.py export-snapshot snapshots/index.tar.gz
+    python cli.py import-snapshot snapshots/index.tar.gz [--force]
+    python cli.py migrate-metadata
+    python cli.py tune-chunking --sizes 200 300 500 --overlaps 0 50 [--output results.json]
+    python cli.py index-writer
+"""
+
+import argparse
+import json
+import os
+
+from src.services.database_service import create_snapshot
+from src.services.index_writer import run_index_writer, submit
+from src.services.tuning_service import format_tuning_results, tune_chunking
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vector database maintenance operations"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Export snapshot
+    export_parser = subparsers.add_parser(
+        "export-snapshot", help="Export the vector database to a snapshot bundle"
+    )
+    export_parser.add_argument("path", help="Path of the snapshot bundle to create")
+
+    # Import snapshot
+    import_parser = subparsers.add_parser(
+        "import-snapshot", help="Import a snapshot bundle into the vector database"
+    )
+    import_parser.add_argument("path", help="Path of the snapshot bundle")
+    import_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Import the snapshot even if it was created with a different embedding model",
+    )
+
+    # Migrate metadata
+    subparsers.add_parser(
+        "migrate-metadata",
+        help="Convert chunks indexed with the legacy metadata format to the compact format",
+    )
+
+    # Tune chunking
+    tune_parser = subparsers.add_parser(
+        "tune-chunking",
+        help="Compare chunk sizes and overlaps (index size, ingest time, hit-rate, prompt tokens)",
+    )
+    tune_parser.add_argument(
+        "--data",
+        nargs="+",
+        default=None,
+        help="Files or directories to index. Defaults to the airline folders in 'policies'",
+    )
+    tune_parser.add_argument(
+        "--questions",
+        default="tuning/questions.json",
+        help="JSON file with the labelled questions",
+    )
+    tune_parser.add_argument(
+        "--sizes", nargs="+", type=int, required=True, help="Chunk sizes to try"
+    )
+    tune_parser.add_argument(
+        "--overlaps", nargs="+", type=int, default=[0], help="Chunk overlaps to try"
+    )
+    tune_parser.add_argument("--output", help="Write the results to a JSON file")
+
+    # Index writer
+    subparsers.add_parser(
+        "index-writer",
+        help="Run the index writer, which applies the write operations of a multi-worker server",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "export-snapshot":
+        print(create_snapshot(snapshot_path=args.path))
+    elif args.command == "import-snapshot":
+        # Write operations go through the index writer if INDEX_WRITER_ADDRESS is set
+        print(submit("load_snapshot", snapshot_path=args.path, force=args.force))
+    elif args.command == "migrate-metadata":
+        print(submit("migrate_metadata"))
+    elif args.command == "tune-chunking":
+        data_path = args.data or [
+            os.path.join("policies", folder)
+            for folder in sorted(os.listdir("policies"))
+            if os.path.isdir(os.path.join("policies", folder))
+        ]
+        results = tune_chunking(
+            data_path=data_path,
+            questions_path=args.questions,
+            chunk_sizes=args.sizes,
+            chunk_overlaps=args.overlaps,
+        )
+        print(format_tuning_results(results))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+    elif args.command == "index-writer":
+        run_index_writer()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
-import uvicorn
+import os
 
+from src.api.multiworker import run_server
 from src.app import app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    run_server(
+        app, host="0.0.0.0", port=8000, workers=int(os.getenv("SERVER_WORKERS", 1))
+    )
@@ -0,0 +1,269 @@
+"""
+Admission control for the query API.
+
+Requests are admitted while there are free execution slots. The rest wait in a bounded priority queue
+(short or cached queries first) for a limited time. When the queueing delay stays above a target for a
+whole interval (CoDel-style), the server is overloaded: new requests that cannot run at once, and queued
+requests that have already waited longer than the target, are rejected immediately with a 503 and a
+Retry-After header, so that the admitted requests keep a good latency instead of all of them timing out.
+The priority of a request only changes its position in the queue: all requests can be shed.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+logger = logging.getLogger(__name__)
+
+# Priorities of the queued requests (lower values are admitted first)
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+
+
+class AdmissionRejectedError(Exception):
+    """Exception raised when a request is not admitted (server overloaded or too many requests of a client)."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the number of requests processed concurrently, queueing or rejecting the rest.
+
+    All the methods must be called from the event loop of the server (they are not thread safe).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue_size: int = 32,
+        max_wait: float = 10.0,
+        max_per_client: int = 2,
+        target_delay: float = 1.0,
+        interval: float = 5.0,
+        short_query_length: int = 20,
+        max_cached_queries: int = 1024,
+    ):
+        """
+        Initialize the admission controller.
+
+        Args:
+            max_concurrency (int, optional): Max number of requests processed at the same time. Defaults to 4.
+            max_queue_size (int, optional): Max number of requests waiting to be processed. Defaults to 32.
+            max_wait (float, optional): Max time (seconds) a request can wait in the queue. Defaults to 10.
+            max_per_client (int, optional): Max number of requests of the same client, processed or waiting.
+                Defaults to 2.
+            target_delay (float, optional): Target queueing delay (seconds). Defaults to 1.
+            interval (float, optional): Time (seconds) the queueing delay must stay above the target to start
+                shedding load. Defaults to 5.
+            short_query_length (int, optional): Queries with at most this number of characters have priority.
+                Defaults to 20.
+            max_cached_queries (int, optional): Number of recently answered queries remembered (they have
+                priority, since their answer is likely cached). Defaults to 1024.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.max_wait = max_wait
+        self.max_per_client = max_per_client
+        self.target_delay = target_delay
+        self.interval = interval
+        self.short_query_length = short_query_length
+        self.max_cached_queries = max_cached_queries
+
+        self._queue = (
+            []
+        )  # Heap of (priority, sequence number, enqueue time, future, client id)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._client_requests: Dict[str, int] = defaultdict(int)
+        self._recent_queries: OrderedDict[str, None] = OrderedDict()
+
+        # CoDel state
+        self._first_above_time = None
+        self._dropping = False
+
+        # Metrics
+        self._avg_service_time = 1.0
+        self.admitted = 0
+        self.shed = defaultdict(int)
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, query: str) -> AsyncIterator[None]:
+        """
+        Waits until the request can be processed. The slot is released when the context is exited.
+
+        Args:
+            client_id (str): identifier of the client (e.g., IP address).
+            query (str): query of the request, used to set its priority.
+
+        Raises:
+            AdmissionRejectedError: if the request is rejected.
+        """
+        await self._acquire(client_id=client_id, priority=self._get_priority(query))
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(client_id=client_id, service_time=time.monotonic() - start)
+
+    def mark_answered(self, query: str):
+        """Remembers a query that has been answered, so that it gets priority if it is asked again."""
+        key = self._normalize_query(query)
+        self._recent_queries[key] = None
+        self._recent_queries.move_to_end(key)
+        while len(self._recent_queries) > self.max_cached_queries:
+            self._recent_queries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """Returns the current state and the counters of the admission controller."""
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": self._get_queue_depth(),
+            "shedding": self._dropping,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "avg_service_time": round(self._avg_service_time, 3),
+        }
+
+    async def _acquire(self, client_id: str, priority: int):
+        """Takes an execution slot, waiting in the queue if needed."""
+        if self._client_requests.get(client_id, 0) >= self.max_per_client:
+            self._reject(
+                reason="client_limit",
+                message="Too many concurrent requests. Please wait for the previous answers.",
+                status_code=429,
+            )
+
+        now = time.monotonic()
+        if self._in_flight < self.max_concurrency and not self._get_queue_depth():
+            self._update_codel(sojourn_time=0.0, now=now)
+            self._start(client_id=client_id)
+            return
+
+        # Under overload, requests that cannot run at once are rejected without waiting
+        if self._dropping:
+            self._reject(reason="overload", message="The server is overloaded.")
+        if self._get_queue_depth() >= self.max_queue_size:
+            self._reject(reason="queue_full", message="The server is overloaded.")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queue, (priority, next(self._sequence), now, future, client_id)
+        )
+        self._client_requests[client_id] += 1
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # The client has disconnected
+            self._abandon(future=future, client_id=client_id)
+            raise
+
+        if not future.done():
+            self._abandon(future=future, client_id=client_id)
+            self._reject(reason="timeout", message="The server is overloaded.")
+        # The result is an AdmissionRejectedError if the request was shed from the queue
+        future.result()
+
+    def _start(self, client_id: str):
+        self._in_flight += 1
+        self._client_requests[client_id] += 1
+        self.admitted += 1
+
+    def _release(self, client_id: str, service_time: float):
+        """Releases an execution slot and admits the next queued requests."""
+        self._in_flight -= 1
+        self._decrement_client(client_id)
+        self._avg_service_time = 0.9 * self._avg_service_time + 0.1 * service_time
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admits queued requests while there are free slots. Stale requests are shed under overload."""
+        while self._queue and self._in_flight < self.max_concurrency:
+            priority, _, enqueue_time, future, client_id = heapq.heappop(self._queue)
+            now = time.monotonic()
+            sojourn_time = now - enqueue_time
+            self._update_codel(sojourn_time=sojourn_time, now=now)
+            if self._dropping and sojourn_time > self.target_delay:
+                self._decrement_client(client_id)
+                self.shed["overload"] += 1
+                future.set_exception(
+                    AdmissionRejectedError(
+                        "The server is overloaded.", retry_after=self._get_retry_after()
+                    )
+                )
+                continue
+
+            # The client count was already incremented when the request was queued
+            self._in_flight += 1
+            self.admitted += 1
+            future.set_result(None)
+
+    def _abandon(self, future: asyncio.Future, client_id: str):
+        """Handles a request that stops waiting (timeout or cancellation)."""
+        if future.done() and not future.cancelled() and future.exception() is None:
+            # The slot was granted just before: release it
+            self._release(client_id=client_id, service_time=0.0)
+        elif not future.done():
+            future.cancel()
+            self._decrement_client(client_id)
+            self._queue = [entry for entry in self._queue if not entry[3].done()]
+            heapq.heapify(self._queue)
+
+    def _update_codel(self, sojourn_time: float, now: float):
+        """Updates the overload state, from the queueing delay of an admitted request (CoDel)."""
+        if sojourn_time < self.target_delay:
+            self._first_above_time = None
+            if self._dropping:
+                logger.info("Queueing delay back under target. Load shedding stopped.")
+                self._dropping = False
+        elif self._first_above_time is None:
+            self._first_above_time = now + self.interval
+        elif now >= self._first_above_time and not self._dropping:
+            logger.warning(
+                f"Queueing delay above {self.target_delay}s for {self.interval}s. Load shedding started."
+            )
+            self._dropping = True
+
+    def _reject(self, reason: str, message: str, status_code: int = 503):
+        self.shed[reason] += 1
+        logger.warning(f"Request rejected ({reason}). {self.get_stats()}")
+        raise AdmissionRejectedError(
+            message, status_code=status_code, retry_after=self._get_retry_after()
+        )
+
+    def _get_retry_after(self) -> float:
+        """Estimates the time (seconds) until the queued requests are processed."""
+        return max(
+            1.0,
+            (self._get_queue_depth() + 1)
+            * self._avg_service_time
+            / self.max_concurrency,
+        )
+
+    def _get_queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _get_priority(self, query: str) -> int:
+        if (
+            len(query) <= self.short_query_length
+            or self._normalize_query(query) in self._recent_queries
+        ):
+            return HIGH_PRIORITY
+        return NORMAL_PRIORITY
+
+    def _decrement_client(self, client_id: str):
+        self._client_requests[client_id] -= 1
+        if self._client_requests[client_id] <= 0:
+            del self._client_requests[client_id]
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
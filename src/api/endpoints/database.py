@@ -8,11 +8,13 @@ import logging
 import os
 from typing import Dict, List, Union
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
-from src.modules.rag.vector_db import VectorDB
-from src.services.database_service import load_documents
+from src.modules.rag.chunk_cache import chunk_cache
+from src.modules.rag.vector_db import VectorDB, refresh_if_index_changed
+from src.services.index_writer import submit
 
 logger = logging.getLogger(__name__)
 
@@ -34,12 +36,22 @@ class RetrieveChunkResponse(BaseModel):
     metadata: Dict
 
 
+class RetrieveChunksRequest(BaseModel):
+    ids: List[str]
+
+
+class RetrieveChunksResponse(BaseModel):
+    chunks: Dict[str, RetrieveChunkResponse]
+    missing_ids: List[str]
+
+
 # Endpoint for loading documents to vector database
 @router.post("/upload_documents")
 async def upload_and_index_document(request: UploadDocRequest):
     data_path = request.data_path
     logger.info(f"Received request to upload the following documents: {data_path}")
-    message = load_documents(data_path=data_path)
+    # Run by the index writer when the server has several workers
+    message = await run_in_threadpool(submit, "load_documents", data_path=data_path)
     return message
 
 
@@ -56,18 +68,60 @@ async def get_indexed_items():
 # Endpoint for retrieving a chunk and its metadata from the Vector DB
 @router.post("/retrieve_chunk", response_model=RetrieveChunkResponse)
 async def retrieve_chunk(request: RetrieveChunkRequest):
-    chroma_path = os.getenv("CHROMA_PATH")
-    vector_db = VectorDB(persist_dir=chroma_path)
-    chunk = vector_db.get_by_id(id=request.id)
+    chunks = get_chunks(ids=[request.id])
+    if request.id not in chunks:
+        raise HTTPException(status_code=404, detail=f"Chunk '{request.id}' not found")
+    chunk = chunks[request.id]
     return RetrieveChunkResponse(
         page_content=chunk.get("page_content", ""), metadata=chunk.get("metadata", {})
     )
 
 
+# Endpoint for retrieving multiple chunks and their metadata from the Vector DB
+@router.post("/retrieve_chunks", response_model=RetrieveChunksResponse)
+async def retrieve_chunks(request: RetrieveChunksRequest):
+    chunks = get_chunks(ids=request.ids)
+    return RetrieveChunksResponse(
+        chunks={
+            id: RetrieveChunkResponse(
+                page_content=chunk.get("page_content", ""),
+                metadata=chunk.get("metadata", {}),
+            )
+            for id, chunk in chunks.items()
+        },
+        missing_ids=[id for id in request.ids if id not in chunks],
+    )
+
+
+def get_chunks(ids: List[str]) -> Dict[str, Dict]:
+    """Retrieves chunks from the chunk cache. Only the chunks that are not cached are retrieved
+    from the Vector DB (in a single lookup), and they are added to the cache.
+
+    Args:
+        ids (List[str]): ids of the chunks to retrieve
+
+    Returns:
+        Dict[str, Dict]: dictionaries containing "page_content" and "metadata" fields, by ID.
+    """
+    chroma_path = os.getenv("CHROMA_PATH")
+    # The cache is discarded if the index has been modified by another process (e.g., chunks deleted)
+    refresh_if_index_changed(persist_dir=chroma_path)
+    chunks = chunk_cache.get_many(ids=ids)
+    missing_ids = [id for id in dict.fromkeys(ids) if id not in chunks]
+    if missing_ids:
+        logger.debug(
+            f"{len(missing_ids)} chunks not cached. Retrieving them from the vector DB"
+        )
+        vector_db = VectorDB(persist_dir=chroma_path)
+        for id, chunk in vector_db.get_by_ids(ids=missing_ids).items():
+            chunk_cache.put(
+                id=id, page_content=chunk["page_content"], metadata=chunk["metadata"]
+            )
+            chunks[id] = chunk
+    return chunks
+
+
 # Endpoint for clearing the Vector DB
 @router.delete("/clear_database")
 async def clear_database():
-    chroma_path = os.getenv("CHROMA_PATH")
-    vector_db = VectorDB(persist_dir=chroma_path)
-    vector_db.clear_database()
-    return "The vector database has been deleted"
+    return await run_in_threadpool(submit, "clear_database")
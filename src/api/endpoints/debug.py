@@ -0,0 +1,61 @@
+"""
+Module containing the API Endpoints for debugging: turning profiling on/off and listing the profiles.
+
+The path of all these endpoints starts with "/debug". All of them require the X-Profile-Token header.
+"""
+
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+
+from src.api.profiling import request_profiler
+
+logger = logging.getLogger(__name__)
+
+
+def check_token(x_profile_token: Optional[str] = Header(default=None)):
+    if not request_profiler.is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+
+# Define router
+router = APIRouter(dependencies=[Depends(check_token)])
+
+
+class ProfilingRequest(BaseModel):
+    next_requests: int = 0
+    sample_rate: float = 0.0
+
+
+# Endpoint for turning profiling on (next N requests or a fraction of the traffic) or off (default values)
+@router.post("/profiling")
+async def configure_profiling(request: ProfilingRequest):
+    request_profiler.configure(
+        next_requests=request.next_requests, sample_rate=request.sample_rate
+    )
+    return request_profiler.get_settings()
+
+
+# Endpoint for getting the current profiling settings
+@router.get("/profiling")
+async def get_profiling_settings():
+    return request_profiler.get_settings()
+
+
+# Endpoint for listing the available profiles (collapsed stacks)
+@router.get("/profiles")
+async def list_profiles():
+    profiles = request_profiler.list_profiles()
+    return {"n_profiles": len(profiles), "profiles": profiles}
+
+
+# Endpoint for downloading a profile
+@router.get("/profiles/{name}")
+async def get_profile(name: str):
+    path = request_profiler.get_profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{name}' not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
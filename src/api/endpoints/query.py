@@ -5,13 +5,18 @@ The path of all these endpoints starts with "/query"
 """
 
 import logging
+import math
 import os
 from typing import List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
+from src.api.admission_control import AdmissionController, AdmissionRejectedError
+from src.api.profiling import request_profiler
 from src.modules.rag.chat_memory import ChatMemory
+from src.modules.rag.llm_client import LLMUnavailableError
 from src.services.query_service import query_rag
 
 logger = logging.getLogger(__name__)
@@ -23,10 +28,53 @@ router = APIRouter()
 chat_memory = ChatMemory(max_memory=int(os.getenv("MAX_CHAT_MEMORY", 3)))
 
 
+# Admission controller, to limit the number of queries processed at the same time and shed load when overloaded.
+# With several worker processes (SERVER_WORKERS), each worker has its own admission controller: the limits of
+# the server are divided between the workers. The per-client limit is approximate, since the requests of a client
+# can reach any worker: a client can have up to n_workers * ceil(ADMISSION_MAX_PER_CLIENT / n_workers) requests
+n_workers = max(1, int(os.getenv("SERVER_WORKERS", 1)))
+admission_controller = AdmissionController(
+    max_concurrency=math.ceil(
+        int(os.getenv("ADMISSION_MAX_CONCURRENCY", 4)) / n_workers
+    ),
+    max_queue_size=math.ceil(
+        int(os.getenv("ADMISSION_MAX_QUEUE_SIZE", 32)) / n_workers
+    ),
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 10)),
+    max_per_client=math.ceil(int(os.getenv("ADMISSION_MAX_PER_CLIENT", 2)) / n_workers),
+    target_delay=float(os.getenv("ADMISSION_TARGET_DELAY", 1)),
+    interval=float(os.getenv("ADMISSION_INTERVAL", 5)),
+    short_query_length=int(os.getenv("ADMISSION_SHORT_QUERY_LENGTH", 20)),
+)
+
+# Reverse proxies allowed to set the client of a request (X-Client-ID header)
+trusted_proxies = {
+    address.strip()
+    for address in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",")
+    if address.strip()
+}
+
+
 def get_chat_memory():
     return chat_memory
 
 
+def get_client_id(request: Request) -> str:
+    """Identifies the client of a request, for per-client limits: IP address of the connection, or X-Client-ID
+    header if the request comes from a trusted proxy (otherwise, any client could pick its own identifier).
+    """
+    peer = request.client.host if request.client else "unknown"
+    client_id = request.headers.get("X-Client-ID")
+    if client_id and peer in trusted_proxies:
+        return client_id
+    return peer
+
+
+def get_profiling(request: Request) -> bool:
+    """Decides whether the request is profiled (X-Profile-Token header, or profiling turned on in /debug)."""
+    return request_profiler.should_profile(token=request.headers.get("X-Profile-Token"))
+
+
 # Define a request body model (if needed)
 class ChatRequest(BaseModel):
     query: str
@@ -40,16 +88,38 @@ class ChatResponse(BaseModel):
 # Endpoint for asking queries
 @router.post("/", response_model=ChatResponse)
 async def chat(
-    request: ChatRequest, chat_memory: ChatMemory = Depends(get_chat_memory)
+    request: ChatRequest,
+    chat_memory: ChatMemory = Depends(get_chat_memory),
+    client_id: str = Depends(get_client_id),
+    profile: bool = Depends(get_profiling),
 ):
 
     query = request.query
     logger.info(f"User query received: '{query}'")
 
-    current_memory = chat_memory.get_memory()
-
-    # Ask RAG
-    response = query_rag(query_text=query, memory=current_memory)
+    # Ask RAG (in a worker thread, so that the server keeps accepting and shedding requests meanwhile)
+    try:
+        async with admission_controller.admit(client_id=client_id, query=query):
+            current_memory = chat_memory.get_memory()
+            query_func = (
+                request_profiler.wrap(query_rag, name="query") if profile else query_rag
+            )
+            response = await run_in_threadpool(
+                query_func, query_text=query, memory=current_memory
+            )
+    except AdmissionRejectedError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=f"{e} Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+    except LLMUnavailableError as e:
+        logger.error(f"The answer could not be generated: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="The language model is temporarily unavailable. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
 
     # Separate response and sources
     answer = response.get("answer")
@@ -57,7 +127,16 @@ async def chat(
 
     logger.info(f"Answer generated:\n{answer}")
 
-    # Update memory
+    # Update memory (with the query of the user, not its rewritten version: follow-ups are always rewritten
+    # from the original queries, so that rewrites do not grow with every follow-up)
     chat_memory.add_memory(query, answer)
+    admission_controller.mark_answered(query)
 
     return ChatResponse(answer=answer, sources=sources)
+
+
+# Endpoint for monitoring the admission control (queue depth, number of rejected requests...).
+# With several worker processes, the stats are those of the worker that handles the request
+@router.get("/admission_stats")
+async def admission_stats():
+    return {"worker_pid": os.getpid(), **admission_controller.get_stats()}
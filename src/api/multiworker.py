@@ -0,0 +1,137 @@
+"""
+Multi-worker mode of the server.
+
+A single Python process serves all the traffic with one GIL. With SERVER_WORKERS > 1, the server runs several
+worker processes that accept connections on the same socket:
+
+1. The embedding model is loaded in the parent process before forking, so its memory pages are shared
+   (copy-on-write) by all the workers instead of being loaded N times.
+2. An index writer process is started. It is the only process that modifies the vector database: the
+   workers open it in read-only mode, and send uploads and other write operations to the writer.
+3. After every write that modifies the index, the writer updates the index version, and the workers reopen
+   the index on their next request, without being restarted.
+
+State kept in memory by the app (chat memory, profiling settings) is created before forking in shared memory,
+so it is shared by the workers. The admission control limits are divided between the workers.
+
+Workers that die are restarted. SIGINT/SIGTERM stop all the processes.
+"""
+
+import gc
+import logging
+import os
+import secrets
+import signal
+import tempfile
+from typing import Callable, Dict
+
+import uvicorn
+
+from src.modules.rag.embeddings import get_embeddings
+from src.services.index_writer import run_index_writer
+
+logger = logging.getLogger(__name__)
+
+
+def run_server(app, host: str = "0.0.0.0", port: int = 8000, workers: int = 1):
+    """
+    Runs the server, in a single process or with several worker processes.
+
+    Args:
+        app: ASGI application.
+        host (str, optional): Host to bind. Defaults to "0.0.0.0".
+        port (int, optional): Port to bind. Defaults to 8000.
+        workers (int, optional): Number of worker processes. Defaults to 1 (single process, no index writer).
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    # Load the embedding model before forking, so that it is shared by the workers.
+    # Only the weights are loaded: running the model here would start thread pools that do not survive fork
+    get_embeddings(
+        provider=os.getenv("EMBEDDINGS_PROVIDER"),
+        model_name=os.getenv("EMBEDDINGS_MODEL"),
+    )
+
+    # The workers and the writer inherit the address of the writer and the key to authenticate to it
+    os.environ.setdefault(
+        "INDEX_WRITER_ADDRESS",
+        os.path.join(tempfile.gettempdir(), f"rag_index_writer_{os.getpid()}.sock"),
+    )
+    os.environ.setdefault("INDEX_WRITER_AUTHKEY", secrets.token_hex(16))
+
+    config = uvicorn.Config(app, host=host, port=port)
+    sock = config.bind_socket()
+
+    def run_worker():
+        os.environ["INDEX_READ_ONLY"] = "true"
+        uvicorn.Server(config).run(sockets=[sock])
+
+    # Objects created so far are not modified by the workers: keep the garbage collector from touching
+    # (and therefore copying) their memory pages
+    gc.freeze()
+
+    processes: Dict[int, str] = {}
+    targets: Dict[str, Callable] = {"index_writer": run_index_writer}
+    targets.update({f"worker_{i}": run_worker for i in range(workers)})
+    for name, target in targets.items():
+        processes[_fork(target=target, name=name)] = name
+    logger.info(f"Server started with {workers} workers and an index writer.")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in processes:
+            _kill(pid)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while processes:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        name = processes.pop(pid, None)
+        if name is None or stopping:
+            continue
+        logger.warning(
+            f"Process '{name}' exited with code {os.waitstatus_to_exitcode(status)}. Restarting it."
+        )
+        processes[_fork(target=targets[name], name=name)] = name
+
+    sock.close()
+    address = os.environ["INDEX_WRITER_ADDRESS"]
+    if os.path.exists(address):
+        os.remove(address)
+    logger.info("Server stopped.")
+
+
+def _fork(target: Callable, name: str) -> int:
+    """Runs a function in a child process. Returns the process ID."""
+    pid = os.fork()
+    if pid:
+        logger.info(f"Started process '{name}' (pid {pid}).")
+        return pid
+
+    # Child process: the signal handlers of the parent are not used
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    exit_code = 0
+    try:
+        target()
+    except BaseException:
+        logger.exception(f"Process '{name}' failed.")
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def _kill(pid: int):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
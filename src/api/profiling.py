@@ -0,0 +1,173 @@
+"""
+On-demand profiling of requests.
+
+Profiling is off by default. It is turned on for a single request with the X-Profile-Token header, or for
+the next N requests / a percentage of the traffic with the /debug/profiling endpoint. Profiled requests are
+sampled by a StackSampler (see src/modules/profiling.py), which records the stack of the thread running the
+request at regular intervals, as well as the stacks of the pool threads working for it (LLM calls, shard
+searches), while they run its tasks. The samples are written as collapsed stacks ("frame;frame;frame count" lines), which can be
+rendered as flamegraphs (e.g., with flamegraph.pl or speedscope).
+
+When profiling is off, the only overhead is checking a header and a few counters.
+"""
+
+import functools
+import hmac
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.modules.profiling import StackSampler
+
+logger = logging.getLogger(__name__)
+
+# Extension of the profile files
+PROFILE_EXTENSION = ".collapsed"
+
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled, profiles them and stores the results in a directory.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str],
+        profiles_dir: str = "./profiles",
+        interval: float = 0.005,
+        max_files: int = 100,
+    ):
+        """
+        Initialize the request profiler.
+
+        Args:
+            token (Optional[str]): Secret that authorizes profiling requests and admin operations.
+                If empty, profiling is disabled.
+            profiles_dir (str, optional): Directory where the profiles are written. Defaults to "./profiles".
+            interval (float, optional): Time (seconds) between stack samples. Defaults to 0.005.
+            max_files (int, optional): Max number of profiles kept. The oldest ones are deleted. Defaults to 100.
+        """
+        self.token = token
+        self.profiles_dir = profiles_dir
+        self.interval = interval
+        self.max_files = max_files
+
+        # The settings are kept in shared memory, so that they apply to all the worker processes of the server
+        # (which are forked after the profiler is created)
+        self._lock = multiprocessing.Lock()
+        self._remaining_requests = multiprocessing.RawValue("i", 0)
+        self._sample_rate = multiprocessing.RawValue("d", 0.0)
+        self._sequence = itertools.count()
+
+    def is_authorized(self, token: Optional[str]) -> bool:
+        """Checks whether a token authorizes profiling. Always False if profiling is disabled."""
+        return bool(self.token and token) and hmac.compare_digest(token, self.token)
+
+    def configure(self, next_requests: int = 0, sample_rate: float = 0.0):
+        """
+        Turns profiling on (or off, with the default values) for upcoming requests.
+
+        Args:
+            next_requests (int, optional): Number of upcoming requests to profile. Defaults to 0.
+            sample_rate (float, optional): Fraction (between 0 and 1) of the requests to profile, after the
+                next_requests have been profiled. Defaults to 0.
+        """
+        with self._lock:
+            self._remaining_requests.value = max(0, next_requests)
+            self._sample_rate.value = min(max(0.0, sample_rate), 1.0)
+        logger.info(
+            f"Profiling configured: next {next_requests} requests, sample rate {sample_rate}"
+        )
+
+    def get_settings(self) -> Dict:
+        return {
+            "enabled": bool(self.token),
+            "next_requests": self._remaining_requests.value,
+            "sample_rate": self._sample_rate.value,
+        }
+
+    def should_profile(self, token: Optional[str] = None) -> bool:
+        """Decides whether a request is profiled, given the value of its X-Profile-Token header."""
+        if token is not None and self.is_authorized(token):
+            return True
+        if not self._remaining_requests.value and not self._sample_rate.value:
+            return False
+        with self._lock:
+            if self._remaining_requests.value > 0:
+                self._remaining_requests.value -= 1
+                return True
+        return random.random() < self._sample_rate.value
+
+    def wrap(self, func: Callable, name: str) -> Callable:
+        """Returns a version of a function that profiles its execution, writing a profile named after name."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sampler = StackSampler(interval=self.interval)
+            try:
+                with sampler:
+                    return func(*args, **kwargs)
+            finally:
+                self._write_profile(sampler=sampler, name=name)
+
+        return wrapper
+
+    def list_profiles(self) -> List[Dict]:
+        """Returns the profiles available, most recent first."""
+        if not os.path.isdir(self.profiles_dir):
+            return []
+        profiles = []
+        for entry in os.scandir(self.profiles_dir):
+            if entry.is_file() and entry.name.endswith(PROFILE_EXTENSION):
+                stat = entry.stat()
+                profiles.append(
+                    {
+                        "name": entry.name,
+                        "size": stat.st_size,
+                        "created_at": time.strftime(
+                            "%Y-%m-%dT%H:%M:%SZ", time.gmtime(stat.st_mtime)
+                        ),
+                    }
+                )
+        return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+    def get_profile_path(self, name: str) -> Optional[str]:
+        """Returns the path of a profile, or None if it does not exist (or the name is not valid)."""
+        if os.path.basename(name) != name or not name.endswith(PROFILE_EXTENSION):
+            return None
+        path = os.path.join(self.profiles_dir, name)
+        return path if os.path.isfile(path) else None
+
+    def _write_profile(self, sampler: StackSampler, name: str):
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        # The process ID keeps the names of the profiles written by different worker processes apart
+        file_name = f"{timestamp}_{os.getpid()}_{next(self._sequence):06d}_{name}{PROFILE_EXTENSION}"
+        with open(os.path.join(self.profiles_dir, file_name), "w") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(
+            f"Profile '{file_name}' written: {sum(sampler.stacks.values())} samples in {sampler.duration:.3f}s"
+        )
+        self._delete_old_profiles()
+
+    def _delete_old_profiles(self):
+        max_files = self.max_files
+        for profile in self.list_profiles()[max_files:]:
+            try:
+                os.remove(os.path.join(self.profiles_dir, profile["name"]))
+            except OSError:
+                pass
+
+
+# Profiler shared by the query and debug endpoints
+request_profiler = RequestProfiler(
+    token=os.getenv("PROFILING_TOKEN"),
+    profiles_dir=os.getenv("PROFILES_DIR", "./profiles"),
+    interval=float(os.getenv("PROFILING_INTERVAL", 0.005)),
+    max_files=int(os.getenv("PROFILING_MAX_FILES", 100)),
+)
@@ -1,22 +1,42 @@
 import logging
+import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
-from src.api.endpoints import database, query
+from src.api.endpoints import database, debug, query
+from src.services.index_writer import submit
 
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start from a prebuilt index snapshot if the vector database is empty (no embeddings are computed).
+    # With several workers, the snapshot is imported by the index writer (only by the first one that asks)
+    snapshot_path = os.getenv("CHROMA_SNAPSHOT")
+    if snapshot_path:
+        message = await run_in_threadpool(
+            submit, "load_snapshot", snapshot_path=snapshot_path, only_if_empty=True
+        )
+        logger.info(message)
+    yield
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Include API routers
 # API router for endpoints related to queries
 app.include_router(query.router, prefix="/query", tags=["Query"])
 # API router for endpoints related to database operations (upload, delete, list...)
 app.include_router(database.router, prefix="/database", tags=["Database"])
+# API router for debugging endpoints (profiling)
+app.include_router(debug.router, prefix="/debug", tags=["Debug"])
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="src/static"), name="static")
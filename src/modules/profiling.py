@@ -0,0 +1,128 @@
+"""
+Sampling of the stacks of a block of code, and of the pool threads running tasks for it.
+
+It is used by the request profiler of the API (src/api/profiling.py). The modules that submit work to thread
+pools wrap their tasks with propagate_profiling, so that the time spent in the pool threads is attributed to
+the profiled request. When no code is profiled, propagate_profiling returns the tasks unchanged.
+"""
+
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+# Sampler of the profiled code running in the current context (None if it is not profiled)
+_current_sampler: ContextVar[Optional["StackSampler"]] = ContextVar(
+    "current_sampler", default=None
+)
+
+
+class StackSampler:
+    """
+    Context manager that samples the stack of the current thread at regular intervals, from a background thread.
+
+    Tasks submitted to thread pools with propagate_profiling are sampled too, while they run. Their stacks
+    start with the name of the pool thread.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Initialize the sampler.
+
+        Args:
+            interval (float, optional): Time (seconds) between samples. Defaults to 0.005.
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.duration = 0.0
+        self._thread_id = None
+        # Pool threads running tasks of the profiled code (thread ID -> thread name)
+        self._pool_threads: Dict[int, str] = {}
+        self._pool_threads_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._context_token = None
+
+    def __enter__(self) -> "StackSampler":
+        self._thread_id = threading.get_ident()
+        self._context_token = _current_sampler.set(self)
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="stack_sampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start_time
+        _current_sampler.reset(self._context_token)
+
+    @contextlib.contextmanager
+    def attach_current_thread(self):
+        """Samples the current (pool) thread too, until the end of the block."""
+        thread = threading.current_thread()
+        with self._pool_threads_lock:
+            self._pool_threads[thread.ident] = thread.name
+        try:
+            yield
+        finally:
+            with self._pool_threads_lock:
+                self._pool_threads.pop(thread.ident, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frame = frames.get(self._thread_id)
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+            with self._pool_threads_lock:
+                pool_threads = list(self._pool_threads.items())
+            for thread_id, thread_name in pool_threads:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[f"{thread_name};{self._collapse(frame)}"] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        """Formats a stack as "outermost;...;innermost" frames."""
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({_shorten_path(code.co_filename)})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+
+def propagate_profiling(func: Callable) -> Callable:
+    """
+    Returns a version of a function to submit to a thread pool, so that the pool thread is sampled with the
+    profiled request that submits it. The function is returned unchanged if the request is not profiled.
+    """
+    sampler = _current_sampler.get()
+    if sampler is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with sampler.attach_current_thread():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _shorten_path(path: str) -> str:
+    """Shortens the path of a source file (relative to site-packages or to the current directory)."""
+    _, separator, package_path = path.rpartition("site-packages" + os.sep)
+    if separator:
+        return package_path
+    try:
+        return os.path.relpath(path)
+    except ValueError:
+        return path
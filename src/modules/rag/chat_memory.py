@@ -1,31 +1,51 @@
+import json
+import multiprocessing
 from typing import Dict, List, Optional
 
 
 class ChatMemory:
     """
     Custom class to store chat memory and make it persistent between queries via API.
+
+    The interactions are stored (JSON encoded) in shared memory, so that the worker processes of the server,
+    which are forked after the chat memory is created, all see the same chat memory.
     """
 
-    def __init__(self, max_memory: int = 3):
+    def __init__(self, max_memory: int = 3, max_size: int = 262144):
         """
         Initialize custom class to store chat memory and make it persistent between queries via API.
 
         Args:
             max_memory (int, optional): Max number of recent chat interactions to store in memory. Defaults to 3.
+            max_size (int, optional): Size (bytes) of the shared memory buffer. The oldest interactions are
+                forgotten if they do not fit. Defaults to 256 KiB.
         """
-        self.chat_memory = []
         self.max_memory = max_memory
+        self._buffer = multiprocessing.Array("c", max_size)
 
     def add_memory(self, question, answer):
         """
         Add question-answer pair to chat memory
         """
-        self.chat_memory.append({"question": question, "answer": answer})
-        if len(self.chat_memory) > self.max_memory:
-            self.chat_memory.pop(0)
+        with self._buffer.get_lock():
+            chat_memory = self._read()
+            chat_memory.append({"question": question, "answer": answer})
+            while len(chat_memory) > self.max_memory:
+                chat_memory.pop(0)
+            data = json.dumps(chat_memory).encode("utf-8")
+            # Forget the oldest interactions if the memory does not fit in the buffer
+            while len(data) >= len(self._buffer) and chat_memory:
+                chat_memory.pop(0)
+                data = json.dumps(chat_memory).encode("utf-8")
+            self._buffer.value = data
 
     def get_memory(self) -> List[Optional[Dict]]:
         """
         Retrieve recent chat history in list format
         """
-        return self.chat_memory
+        with self._buffer.get_lock():
+            return self._read()
+
+    def _read(self) -> List[Dict]:
+        data = self._buffer.value
+        return json.loads(data) if data else []
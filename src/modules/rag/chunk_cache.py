@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkCache:
+    """
+    Bounded in-memory LRU cache of chunks (content and metadata), indexed by chunk ID.
+
+    It is filled with the chunks retrieved when answering queries, so that the sources shown
+    to the user can be served without querying the vector database.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        """
+        Initialize the chunk cache.
+
+        Args:
+            max_size (int, optional): Max number of chunks to keep in the cache. Defaults to 1024.
+        """
+        self.max_size = max_size
+        self._chunks: OrderedDict[str, Dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, id: str) -> Optional[Dict]:
+        """
+        Retrieve a chunk from the cache, given its ID.
+
+        Returns:
+            Optional[Dict]: dictionary containing "page_content" and "metadata" fields, or None if it is not cached.
+        """
+        return self.get_many(ids=[id]).get(id)
+
+    def get_many(self, ids: List[str]) -> Dict[str, Dict]:
+        """
+        Retrieve multiple chunks from the cache, given their IDs.
+
+        Returns:
+            Dict[str, Dict]: cached chunks by ID. IDs that are not cached are not included.
+        """
+        chunks = {}
+        with self._lock:
+            for id in ids:
+                chunk = self._chunks.get(id)
+                if chunk is None:
+                    self.misses += 1
+                    continue
+                self._chunks.move_to_end(id)
+                self.hits += 1
+                chunks[id] = chunk
+        return chunks
+
+    def put(self, id: str, page_content: str, metadata: Dict):
+        """
+        Add a chunk to the cache. The least recently used chunks are evicted if the cache is full.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._chunks[id] = {
+                "page_content": page_content,
+                "metadata": dict(metadata),
+            }
+            self._chunks.move_to_end(id)
+            while len(self._chunks) > self.max_size:
+                self._chunks.popitem(last=False)
+
+    def invalidate(self, ids: List[str]):
+        """
+        Remove chunks from the cache, given their IDs (e.g., because they have been modified in the vector DB).
+        """
+        with self._lock:
+            for id in ids:
+                self._chunks.pop(id, None)
+
+    def clear(self):
+        """
+        Remove all the chunks from the cache.
+        """
+        with self._lock:
+            self._chunks.clear()
+        logger.debug("The chunk cache has been cleared.")
+
+
+# Cache shared by the query and database endpoints
+chunk_cache = ChunkCache(max_size=int(os.getenv("CHUNK_CACHE_SIZE", 1024)))
@@ -0,0 +1,246 @@
+# Standard imports
+import hashlib
+import logging
+import re
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Third party imports
+import numpy as np
+from langchain_core.documents import Document
+
+# Local imports
+from src.modules.rag.vector_db import get_chunk_id
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used for the universal hash functions (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+class Deduplicator:
+    """Class for detecting and removing near-duplicate chunks before indexing them.
+
+    Each chunk is represented by a MinHash signature of its word shingles. Signatures are
+    inserted in a Locality Sensitive Hashing (LSH) index, so that only chunks sharing at least
+    one band of their signature are compared. A chunk is considered a duplicate if its estimated
+    Jaccard similarity with an already kept chunk of the same airline ("parent_folder") is above the
+    threshold. Chunks of different airlines are never merged, so that each airline keeps its own copy
+    (airline filters and per-airline collections would not find the other one).
+
+    Duplicates are not indexed. Instead, their ids are recorded in the "aliases" metadata field
+    of the chunk that is kept, so that sources stay attributable.
+
+    Chunks are compared with the chunks seen by this Deduplicator. To also detect duplicates of chunks indexed
+    by previous uploads, a function that loads the indexed chunks of an airline can be given: the signatures
+    of those chunks are computed the first time a chunk of the airline is seen.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 5,
+        seed: int = 1,
+        load_indexed_chunks: Optional[Callable[[str], Iterable[Document]]] = None,
+    ) -> None:
+        """Initialize Deduplicator class
+
+        Args:
+            threshold (float, optional): min. estimated Jaccard similarity for two chunks to be duplicates. Defaults to 0.9.
+            num_perm (int, optional): number of hash functions of the MinHash signature. Defaults to 128.
+            bands (int, optional): number of LSH bands. It must divide num_perm. Defaults to 32.
+            shingle_size (int, optional): number of words per shingle. Defaults to 5.
+            seed (int, optional): seed for generating the hash functions. Defaults to 1.
+            load_indexed_chunks (Optional[Callable[[str], Iterable[Document]]], optional): function that returns
+                the chunks already indexed for an airline, with their id (and aliases) in the metadata.
+                Defaults to None (only the chunks seen by this Deduplicator are compared).
+        """
+        if num_perm % bands != 0:
+            raise ValueError(
+                f"The number of bands ({bands}) must divide the number of permutations ({num_perm})."
+            )
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.load_indexed_chunks = load_indexed_chunks
+
+        # Parameters of the hash functions (a * x + b) mod p
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        # LSH index: one dictionary of buckets per band, by (airline, band key). Each bucket holds ids of kept chunks
+        self._buckets: List[Dict[Tuple[str, bytes], List[str]]] = [
+            defaultdict(list) for _ in range(self.bands)
+        ]
+        # MinHash signatures of the kept chunks
+        self._signatures: Dict[str, np.ndarray] = {}
+        # Aliases of each kept chunk (ids of the duplicates that have been skipped)
+        self.aliases: Dict[str, List[str]] = defaultdict(list)
+        # Kept chunks already returned by a previous call, and those of them that got new aliases afterwards
+        self._returned_ids = set()
+        self._late_alias_ids = set()
+        # Airlines whose indexed chunks have been loaded
+        self._loaded_airlines = set()
+
+        # Statistics
+        self.n_chunks = 0
+        self.n_duplicates = 0
+        self.bytes_saved = 0
+
+    def deduplicate(self, documents: List[List[Document]]) -> List[List[Document]]:
+        """Removes near-duplicate chunks from a list of documents.
+
+        Chunks are compared against every chunk seen so far by this Deduplicator, including
+        chunks from previous calls, so that documents can be deduplicated in batches.
+
+        Args:
+            documents (List[List[Document]]): each sublist corresponds to a file.
+                Each element inside a sublist corresponds to a chunk.
+
+        Returns:
+            List[List[Document]]: same structure, without the duplicate chunks.
+        """
+        deduplicated_documents = []
+        kept_chunks = []
+
+        for doc in documents:
+            deduplicated_doc = []
+            for chunk in doc:
+                self.n_chunks += 1
+                chunk_id = get_chunk_id(metadata=chunk.metadata)
+                signature = self._get_signature(text=chunk.page_content)
+                airline = chunk.metadata.get("parent_folder", "")
+                self._load_airline(airline=airline)
+
+                original_id = self._find_duplicate(signature=signature, airline=airline)
+                if original_id == chunk_id:
+                    # The chunk itself is already indexed (the document is uploaded again)
+                    deduplicated_doc.append(chunk)
+                    kept_chunks.append((chunk_id, chunk))
+                    continue
+                if original_id is not None:
+                    logger.debug(
+                        f"Chunk '{chunk_id}' is a near-duplicate of '{original_id}'. Skipping it."
+                    )
+                    if chunk_id not in self.aliases[original_id]:
+                        self.aliases[original_id].append(chunk_id)
+                        if original_id in self._returned_ids:
+                            self._late_alias_ids.add(original_id)
+                    self.n_duplicates += 1
+                    self.bytes_saved += len(chunk.page_content.encode("utf-8"))
+                    continue
+
+                self._insert(chunk_id=chunk_id, signature=signature, airline=airline)
+                deduplicated_doc.append(chunk)
+                kept_chunks.append((chunk_id, chunk))
+
+            if deduplicated_doc:
+                deduplicated_documents.append(deduplicated_doc)
+
+        # Record the aliases of the kept chunks in their metadata
+        for chunk_id, chunk in kept_chunks:
+            if self.aliases.get(chunk_id):
+                chunk.metadata["aliases"] = ",".join(self.aliases[chunk_id])
+            self._returned_ids.add(chunk_id)
+
+        return deduplicated_documents
+
+    def pop_late_aliases(self) -> Dict[str, Dict]:
+        """Returns the aliases of chunks returned by previous calls that got new duplicates afterwards.
+        Their metadata must be updated in the vector database, since they might be already indexed.
+
+        Returns:
+            Dict[str, Dict]: metadata fields to update ("aliases"), by chunk id.
+        """
+        late_aliases = {
+            chunk_id: {"aliases": ",".join(self.aliases[chunk_id])}
+            for chunk_id in self._late_alias_ids
+        }
+        self._late_alias_ids = set()
+        return late_aliases
+
+    def get_report(self) -> str:
+        """Returns a message summarizing the duplicates found and the resources saved."""
+        return (
+            f"{self.n_duplicates}/{self.n_chunks} chunks were near-duplicates and have been skipped "
+            f"({self.bytes_saved} bytes and {self.n_duplicates} embeddings saved)"
+        )
+
+    def _get_shingles(self, text: str) -> List[str]:
+        """Splits a text into overlapping groups of words (shingles), after normalizing it."""
+        words = re.findall(r"\w+", text.lower())
+        if len(words) <= self.shingle_size:
+            return [" ".join(words)]
+        # Each shingle takes one word from each of the shifted lists of words
+        shifted_words = [words[i:] for i in range(self.shingle_size)]
+        return [" ".join(shingle) for shingle in zip(*shifted_words)]
+
+    def _get_signature(self, text: str) -> np.ndarray:
+        """Computes the MinHash signature of a text."""
+        shingle_hashes = np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(),
+                    "little",
+                )
+                % _MERSENNE_PRIME
+                for shingle in set(self._get_shingles(text))
+            ],
+            dtype=np.uint64,
+        )
+        # Apply all the hash functions to all the shingles at once, and keep the minimum value per function
+        hashes = (
+            np.outer(self._a, shingle_hashes) + self._b[:, None]
+        ) % _MERSENNE_PRIME
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def _get_band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        """Splits a signature into bands. Returns the bucket key of each band."""
+        bands = signature.reshape(self.bands, self.rows)
+        return [(band, bands[band].tobytes()) for band in range(self.bands)]
+
+    def _load_airline(self, airline: str):
+        """Inserts the signatures of the chunks already indexed for an airline, the first time it is seen."""
+        if self.load_indexed_chunks is None or airline in self._loaded_airlines:
+            return
+        self._loaded_airlines.add(airline)
+        n_indexed_chunks = 0
+        for chunk in self.load_indexed_chunks(airline):
+            chunk_id = chunk.metadata["id"]
+            self._insert(
+                chunk_id=chunk_id,
+                signature=self._get_signature(text=chunk.page_content),
+                airline=airline,
+            )
+            aliases = chunk.metadata.get("aliases")
+            if aliases:
+                self.aliases[chunk_id] = aliases.split(",")
+            # Indexed chunks get their new aliases with pop_late_aliases
+            self._returned_ids.add(chunk_id)
+            n_indexed_chunks += 1
+        logger.debug(
+            f"Signatures of {n_indexed_chunks} indexed chunks of '{airline}' computed."
+        )
+
+    def _find_duplicate(self, signature: np.ndarray, airline: str):
+        """Returns the id of a kept chunk of the airline that is a near-duplicate of the given signature, or None."""
+        candidates = set()
+        for band, key in self._get_band_keys(signature):
+            candidates.update(self._buckets[band].get((airline, key), []))
+
+        for candidate_id in candidates:
+            similarity = float(np.mean(self._signatures[candidate_id] == signature))
+            if similarity >= self.threshold:
+                return candidate_id
+        return None
+
+    def _insert(self, chunk_id: str, signature: np.ndarray, airline: str):
+        """Inserts the signature of a kept chunk in the LSH index of its airline."""
+        self._signatures[chunk_id] = signature
+        for band, key in self._get_band_keys(signature):
+            self._buckets[band][(airline, key)].append(chunk_id)
@@ -2,7 +2,7 @@
 import logging
 import os
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union
+from typing import Iterator, List, Optional, Union
 
 # Third party imports
 from langchain_community.document_loaders import PyPDFLoader
@@ -58,7 +58,18 @@ class DocumentReader:
         Returns:
             List[List[Document]]: each sublist corresponds to a file. Each element inside a sublist corresponds to a page.
         """
-        documents = []
+        return [list(doc) for doc in self.lazy_read_documents()]
+
+    def lazy_read_documents(self) -> Iterator[Iterator[Document]]:
+        """Lazily read list of documents in different formats, using the appropriate Loader.
+
+        Files are not read until their pages are consumed, so only a small window of
+        the documents is kept in memory at any time.
+
+        Yields:
+            Iterator[Document]: one iterator per file. Each element yielded by the iterator corresponds to a page (or section).
+        """
+        n_documents = 0
 
         for file_path in self.file_paths:
 
@@ -79,25 +90,34 @@ class DocumentReader:
                 )
                 # raise ValueError(f"Could not load file '{file_path}'. Unsupported file type: '{ext}'")
 
-            # Load file and append to list
+            # Yield the lazy page iterator of the file
             if loader:
-                doc_content = loader.load_file(file_path=file_path)
-                documents.append(doc_content)
+                n_documents += 1
+                yield loader.lazy_load_file(file_path=file_path)
 
         # Raise exception if no documents could be loaded
-        if not documents:
+        if not n_documents:
             raise Exception("No files could be loaded from the provided paths")
 
-        return documents
-
 
 class Loader(ABC):
     """Abstract class for loading documents in specific formats"""
 
     @abstractmethod
-    def load_file(self, file_path: str) -> List[Document]:
+    def lazy_load_file(self, file_path: str) -> Iterator[Document]:
         pass
 
+    def load_file(self, file_path: str) -> List[Document]:
+        """Loads a file and returns the list of all its parsed pages in LangChain's Document format.
+
+        Args:
+            file_path (str): input file path
+
+        Returns:
+            List[Document]: list of Document Objects.
+        """
+        return list(self.lazy_load_file(file_path=file_path))
+
     def _add_metadata(
         self,
         doc: Document,
@@ -126,55 +146,120 @@ class Loader(ABC):
 class PdfLoader(Loader):
     """Class for loading PDF files in LangChain format"""
 
-    def load_file(self, file_path: str) -> List[Document]:
-        """Loads a PDF file and returns a list of parsed pages in LangChain's Document format.
+    def lazy_load_file(self, file_path: str) -> Iterator[Document]:
+        """Lazily loads a PDF file, yielding its parsed pages in LangChain's Document format.
 
         Args:
             file_path (str): input file path
 
-        Returns:
-            List[Document]: list of Document Objects. Each element corresponds to a page from the pdf file.
+        Yields:
+            Document: Document Object corresponding to a page from the pdf file.
         """
         loader = PyPDFLoader(file_path)
-        document_pages = loader.load()
-        for i, page in enumerate(document_pages):
-            document_pages[i] = self._add_metadata(
-                doc=page, extension=".pdf", file_path=file_path
-            )
-        return document_pages
+        for page in loader.lazy_load():
+            yield self._add_metadata(doc=page, extension=".pdf", file_path=file_path)
 
 
 class MdLoader(Loader):
     """Class for loading Markdown files in LangChain format"""
 
-    def load_file(self, file_path: str) -> List[Document]:
-        """Loads a Markdown file and returns a list of parsed pages in LangChain's Document format.
+    def __init__(self, max_header_level: int = 3) -> None:
+        """Initialize MdLoader class
+
+        Args:
+            max_header_level (int, optional): deepest header level that starts a new section. Defaults to 3 (###).
+        """
+        super().__init__()
+        self.max_header_level = max_header_level
+
+    def lazy_load_file(self, file_path: str) -> Iterator[Document]:
+        """Lazily loads a Markdown file, yielding one Document per header section.
+
+        The file is read line by line. Each section starts with the header lines of all
+        its parent sections, so that it can be split on its own without losing the
+        header structure of the document.
 
         Args:
             file_path (str): input file path
 
-        Returns:
-            List[Document]: list of Document Objects.
+        Yields:
+            Document: Document Object corresponding to a section of the file.
         """
         # # Alternative: using Langchain's unstructuredMarkdownLoader
         # from langchain_community.document_loaders import UnstructuredMarkdownLoader
         # loader = UnstructuredMarkdownLoader(file_path)
         # document_content = loader.load()
 
+        # Headers of the current section and its parent sections, by header level
+        headers = {}
+        section_lines = []
+        section_has_content = False
+        in_code_block = False
+
         with open(file_path, "r") as f:
-            file_content_raw = f.read()
+            for line in f:
+                stripped_line = line.strip()
+
+                # Headers inside code blocks must not start new sections
+                if stripped_line.startswith("```") or stripped_line.startswith("~~~"):
+                    in_code_block = not in_code_block
+                header_level = (
+                    None if in_code_block else self._get_header_level(stripped_line)
+                )
 
+                if header_level is None:
+                    section_lines.append(line)
+                    section_has_content = section_has_content or bool(stripped_line)
+                    continue
+
+                # Keep only the headers of the parent sections
+                new_headers = {
+                    level: header
+                    for level, header in headers.items()
+                    if level < header_level
+                }
+                new_headers[header_level] = stripped_line
+
+                # A repeated header continues the current section (its lines belong to the same chunk)
+                if new_headers == headers:
+                    continue
+
+                # A new section starts: yield the previous one
+                if section_has_content:
+                    yield self._create_section(
+                        content="".join(section_lines), file_path=file_path
+                    )
+
+                # Start the new section with the headers of its parent sections
+                headers = new_headers
+                section_lines = [f"{header}\n" for _, header in sorted(headers.items())]
+                section_has_content = False
+
+        if section_has_content:
+            yield self._create_section(
+                content="".join(section_lines), file_path=file_path
+            )
+
+    def _get_header_level(self, line: str) -> Optional[int]:
+        """Returns the level of a Markdown header line (e.g., 2 for '## Title'), or None if the line is not a header."""
+        for level in range(self.max_header_level, 0, -1):
+            header_symbol = "#" * level
+            if line.startswith(header_symbol) and (
+                len(line) == level or line[level] == " "
+            ):
+                return level
+        return None
+
+    def _create_section(self, content: str, file_path: str) -> Document:
+        """Creates a Document Object with the content of a section and its metadata."""
         document_object = Document(
-            page_content=file_content_raw,
+            page_content=content,
             metadata={
                 "source": file_path,
             },
         )
 
         # Add metadata fields
-        document_object = self._add_metadata(
+        return self._add_metadata(
             doc=document_object, extension=".md", file_path=file_path
         )
-
-        # Encapsulate in List for consistency
-        return [document_object]
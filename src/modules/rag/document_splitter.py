@@ -1,13 +1,16 @@
 # Standard imports
+import itertools
 import logging
 import os
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional
 
 # Third party imports
 from langchain_core.documents import Document
-from langchain_text_splitters import (MarkdownHeaderTextSplitter,
-                                      RecursiveCharacterTextSplitter)
+from langchain_text_splitters import (
+    MarkdownHeaderTextSplitter,
+    RecursiveCharacterTextSplitter,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +18,45 @@ logger = logging.getLogger(__name__)
 class DocumentSplitter:
     """Class for splitting a list of documents into chunks"""
 
-    def __init__(self, documents: List[List[Document]]) -> None:
+    def __init__(
+        self,
+        documents: Iterable[Iterable[Document]],
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+        markdown_max_chunk_size: Optional[int] = None,
+        length_function: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        """Initialize DocumentSplitter class
+
+        Sizes are measured with length_function: in tokens if it is a token counter (e.g., the tokenizer of
+        the embedding model), or in characters by default.
+
+        Args:
+            documents (Iterable[Iterable[Document]]): each element corresponds to a file, given as a list
+                or an iterator of pages. Iterators are only consumed by lazy_split_documents.
+            chunk_size (Optional[int], optional): size of the chunks of the recursive splitter.
+                Defaults to the RECURSIVE_CHUNK_SIZE env variable.
+            chunk_overlap (Optional[int], optional): overlap between consecutive chunks.
+                Defaults to the RECURSIVE_CHUNK_OVERLAP env variable.
+            markdown_max_chunk_size (Optional[int], optional): max size of the chunks of a markdown header
+                group. Larger groups are split recursively. 0 means no limit.
+                Defaults to the MARKDOWN_MAX_CHUNK_SIZE env variable.
+            length_function (Optional[Callable[[str], int]], optional): function that measures the size of
+                a text. Defaults to the number of characters.
+        """
         self.documents = documents
+        self.chunk_size = chunk_size or int(os.getenv("RECURSIVE_CHUNK_SIZE", 1200))
+        self.chunk_overlap = (
+            chunk_overlap
+            if chunk_overlap is not None
+            else int(os.getenv("RECURSIVE_CHUNK_OVERLAP", 80))
+        )
+        self.markdown_max_chunk_size = (
+            markdown_max_chunk_size
+            if markdown_max_chunk_size is not None
+            else int(os.getenv("MARKDOWN_MAX_CHUNK_SIZE", 0))
+        )
+        self.length_function = length_function or len
 
     def split_documents(self) -> List[List[Document]]:
         """Splits a list of documents into chunks, using the appropriate Splitter depending on the file type.
@@ -30,22 +70,7 @@ class DocumentSplitter:
 
             logger.debug(f"Splitting document {doc[0].metadata.get('source')}")
 
-            splitter = None
-
-            ext = doc[0].metadata.get("extension", "")
-
-            if ext == ".pdf":
-                chunk_size = int(os.getenv("RECURSIVE_CHUNK_SIZE", 1200))
-                chunk_overlap = int(os.getenv("RECURSIVE_CHUNK_OVERLAP", 80))
-                splitter = RecursiveSplitter(
-                    chunk_size=chunk_size, chunk_overlap=chunk_overlap
-                )
-            elif ext == ".md":
-                splitter = MarkdownSplitter()
-            else:
-                logger.warning(
-                    f"Could not split document '{doc[0].metadata.get('source')}'. Unsupported file type: '{ext}'"
-                )
+            splitter = self._get_splitter(document=doc[0])
 
             # Split file and append to list
             if splitter:
@@ -60,6 +85,68 @@ class DocumentSplitter:
 
         return splitted_documents
 
+    def lazy_split_documents(self) -> Iterator[Document]:
+        """Lazily splits documents into chunks, consuming their pages incrementally.
+
+        Yields:
+            Document: chunks of all the documents, one file after another.
+        """
+        n_splitted_documents = 0
+
+        for doc in self.documents:
+
+            # Get first page of the document, to know which splitter must be used
+            pages = iter(doc)
+            first_page = next(pages, None)
+            if first_page is None:
+                continue
+
+            logger.debug(f"Splitting document {first_page.metadata.get('source')}")
+
+            splitter = self._get_splitter(document=first_page)
+
+            # Split file page by page
+            if splitter:
+                n_splitted_documents += 1
+                yield from splitter.lazy_split_document(
+                    documents=itertools.chain([first_page], pages)
+                )
+
+        # Raise exception if no documents could be loaded
+        if not n_splitted_documents:
+            raise Exception(
+                "The specified documents could not be splitted into chunks."
+            )
+
+    def _get_splitter(self, document: Document) -> Optional["Splitter"]:
+        """Selects the appropriate Splitter for a document, depending on its file type.
+
+        Args:
+            document (Document): any page of the document
+
+        Returns:
+            Optional[Splitter]: the splitter, or None if the file type is not supported
+        """
+        ext = document.metadata.get("extension", "")
+
+        if ext == ".pdf":
+            return RecursiveSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                length_function=self.length_function,
+            )
+        elif ext == ".md":
+            return MarkdownSplitter(
+                max_chunk_size=self.markdown_max_chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                length_function=self.length_function,
+            )
+
+        logger.warning(
+            f"Could not split document '{document.metadata.get('source')}'. Unsupported file type: '{ext}'"
+        )
+        return None
+
 
 class Splitter(ABC):
     """
@@ -79,6 +166,25 @@ class Splitter(ABC):
         """
         pass
 
+    def lazy_split_document(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        Lazily splits a document into chunks, one page at a time.
+
+        Chunks never span more than one page, so the result is the same as splitting the whole document at once.
+
+        Args:
+            documents (Iterable[Document]): document to be splitted. Each element is a page of the document.
+
+        Yields:
+            Document: chunks, with a running "order" field in their metadata.
+        """
+        order = 0
+        for page in documents:
+            for chunk in self.split_document(documents=[page]):
+                chunk.metadata["order"] = order
+                order += 1
+                yield chunk
+
 
 class RecursiveSplitter(Splitter):
     """Class for splitting documents into chunks using recursive chunking.
@@ -87,12 +193,19 @@ class RecursiveSplitter(Splitter):
     using a set of separators (e.g: '\\n\\n', '\\n', ' '...).
     """
 
-    def __init__(self, chunk_size: int, chunk_overlap: int) -> None:
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_overlap: int,
+        length_function: Callable[[str], int] = len,
+    ) -> None:
         super().__init__()
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=length_function,
         )
 
     def split_document(self, documents: List[Document]) -> List[Document]:
@@ -107,11 +220,20 @@ class MarkdownSplitter(Splitter):
     """Class for splitting Markdown documents into chunks.
 
     This chunking method is based on creating chunks within specific header groups, taking
-    advantage of the structure of the markdown file.
+    advantage of the structure of the markdown file. Header groups larger than max_chunk_size
+    are split recursively, and their headers are repeated at the beginning of each chunk.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_chunk_size: int = 0,
+        chunk_overlap: int = 0,
+        length_function: Callable[[str], int] = len,
+    ) -> None:
         super().__init__()
+        self.max_chunk_size = max_chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
 
         # Set of headers we want to consider for splitting
         self.headers_to_split_on = [
@@ -129,19 +251,51 @@ class MarkdownSplitter(Splitter):
         for doc in documents:
             # Split document's text into chunks. The metadata of each chunk will include the headers it belongs to.
             splitted_doc = self.splitter.split_text(doc.page_content)
-            for i, chunk in enumerate(splitted_doc):
-                # Add markdown headers at the beginning of the chunk's content
-                for header_symbol, header_name in reversed(self.headers_to_split_on):
-                    header_content = chunk.metadata.get(header_name, "")
-                    if header_content:
-                        chunk.page_content = (
-                            f"{header_symbol} {header_content}\n\n{chunk.page_content}"
-                        )
-                # Update chunk's metadata with corresponding document's metadata
-                # chunk.metadata.update(doc.metadata)
-                chunk.metadata = doc.metadata.copy()
-                # Add chunk order in metadata (to create chunk ids later)
-                chunk.metadata["order"] = i
-                # Append chunk to final list
-                chunks.append(chunk)
+            for header_group in splitted_doc:
+                # Markdown headers, added at the beginning of the chunk's content
+                headers_text = "".join(
+                    f"{header_symbol} {header_group.metadata[header_name]}\n\n"
+                    for header_symbol, header_name in self.headers_to_split_on
+                    if header_group.metadata.get(header_name)
+                )
+                # Header path of the chunk (e.g., "Baggage > Carry-on"), stored instead of one field per header
+                header_path = " > ".join(
+                    header_group.metadata[header_name]
+                    for _, header_name in self.headers_to_split_on
+                    if header_group.metadata.get(header_name)
+                )
+                for content in self._split_header_group(
+                    header_group.page_content, headers_text=headers_text
+                ):
+                    # Update chunk's metadata with corresponding document's metadata
+                    chunk = Document(
+                        page_content=f"{headers_text}{content}",
+                        metadata=doc.metadata.copy(),
+                    )
+                    if header_path:
+                        chunk.metadata["headers"] = header_path
+                    # Add chunk order in metadata (to create chunk ids later)
+                    chunk.metadata["order"] = len(chunks)
+                    # Append chunk to final list
+                    chunks.append(chunk)
         return chunks
+
+    def _split_header_group(self, text: str, headers_text: str) -> List[str]:
+        """Splits the text of a header group if the chunk (including its headers) exceeds max_chunk_size."""
+        if (
+            not self.max_chunk_size
+            or self.length_function(f"{headers_text}{text}") <= self.max_chunk_size
+        ):
+            return [text]
+
+        # The headers are repeated in every chunk, so they take part of its size
+        chunk_size = max(
+            self.max_chunk_size - self.length_function(headers_text),
+            self.max_chunk_size // 2,
+        )
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=min(self.chunk_overlap, chunk_size // 2),
+            length_function=self.length_function,
+        )
+        return splitter.split_text(text)
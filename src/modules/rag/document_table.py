@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Name of the SQLite file where the document table is persisted, inside the vector DB directory
+DOCUMENT_TABLE_FILE = "documents.sqlite3"
+
+
+class DocumentTable:
+    """
+    Table of the documents (files) indexed in the vector DB, persisted in a SQLite file.
+
+    Each document gets an integer doc_id, so that chunks only need to store the doc_id in their
+    metadata instead of the full source path, airline and extension. The table is kept in memory
+    after the first read, so that lookups do not hit the disk.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the document table.
+
+        Args:
+            path (str): path of the SQLite file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._documents: Optional[Dict[int, Dict]] = None
+        self._doc_ids_by_source: Dict[str, int] = {}
+
+    def get(self, doc_id: int) -> Optional[Dict]:
+        """
+        Returns a document, given its doc_id.
+
+        Returns:
+            Optional[Dict]: dictionary with fields "source", "parent_folder", "extension" and "hash",
+                or None if it does not exist.
+        """
+        return self._load().get(doc_id)
+
+    def get_doc_id(self, source: str) -> Optional[int]:
+        """
+        Returns the doc_id of a document, given its source path, or None if it does not exist.
+        """
+        self._load()
+        return self._doc_ids_by_source.get(source)
+
+    def get_or_create(self, source: str, parent_folder: str, extension: str) -> int:
+        """
+        Returns the doc_id of a document. The document is added to the table if it does not exist.
+
+        Args:
+            source (str): path of the file.
+            parent_folder (str): name of the airline the document belongs to.
+            extension (str): file extension.
+
+        Returns:
+            int: the doc_id
+        """
+        doc_id = self.get_doc_id(source)
+        if doc_id is not None:
+            return doc_id
+
+        with self._lock:
+            # Check again, in case another thread has just added the document
+            if source in self._doc_ids_by_source:
+                return self._doc_ids_by_source[source]
+
+            file_hash = get_file_hash(source)
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute(
+                    "INSERT INTO documents (source, parent_folder, extension, hash) VALUES (?, ?, ?, ?)",
+                    (source, parent_folder, extension, file_hash),
+                )
+                doc_id = cursor.lastrowid
+
+            self._documents[doc_id] = {
+                "source": source,
+                "parent_folder": parent_folder,
+                "extension": extension,
+                "hash": file_hash,
+            }
+            self._doc_ids_by_source[source] = doc_id
+            logger.debug(
+                f"Document '{source}' added to the document table (doc_id={doc_id})"
+            )
+            return doc_id
+
+    def get_doc_ids(self, airlines: List[str]) -> List[int]:
+        """
+        Returns the doc_ids of all the documents of some airlines.
+        """
+        return [
+            doc_id
+            for doc_id, document in self._load().items()
+            if document["parent_folder"] in airlines
+        ]
+
+    def list_airlines(self) -> List[str]:
+        """
+        Returns the list of airlines of the documents in the table.
+        """
+        return sorted(
+            set(document["parent_folder"] for document in self._load().values())
+        )
+
+    def reload(self):
+        """
+        Discards the in-memory copy of the table, so that it is read again from disk on next use
+        (e.g., after the vector DB has been deleted).
+        """
+        with self._lock:
+            self._documents = None
+            self._doc_ids_by_source = {}
+
+    def _load(self) -> Dict[int, Dict]:
+        """Reads the table from disk, if it is not in memory yet."""
+        if self._documents is None:
+            with self._lock:
+                if self._documents is None:
+                    with closing(self._connect()) as conn:
+                        rows = conn.execute(
+                            "SELECT doc_id, source, parent_folder, extension, hash FROM documents"
+                        ).fetchall()
+                    self._doc_ids_by_source = {row[1]: row[0] for row in rows}
+                    self._documents = {
+                        row[0]: {
+                            "source": row[1],
+                            "parent_folder": row[2],
+                            "extension": row[3],
+                            "hash": row[4],
+                        }
+                        for row in rows
+                    }
+        return self._documents
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                source TEXT UNIQUE NOT NULL,
+                parent_folder TEXT,
+                extension TEXT,
+                hash TEXT
+            )"""
+        )
+        return conn
+
+
+def get_file_hash(path: str, chunk_size: int = 1 << 20) -> Optional[str]:
+    """Computes the SHA-256 hash of a file, reading it in chunks. Returns None if the file does not exist."""
+    if not os.path.isfile(path):
+        return None
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+_document_tables: Dict[str, DocumentTable] = {}
+_document_tables_lock = threading.Lock()
+
+
+def get_document_table(persist_dir: str) -> DocumentTable:
+    """
+    Returns the document table of a vector DB directory. Tables are shared within the process,
+    so that the in-memory copy is reused between requests.
+    """
+    path = os.path.abspath(os.path.join(persist_dir, DOCUMENT_TABLE_FILE))
+    with _document_tables_lock:
+        if path not in _document_tables:
+            _document_tables[path] = DocumentTable(path=path)
+        return _document_tables[path]
@@ -1,5 +1,8 @@
+import functools
 import logging
+import threading
 from enum import Enum
+from typing import Callable, Dict, Optional, Tuple
 
 from langchain.embeddings.base import Embeddings
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
@@ -27,7 +30,9 @@ class CustomEmbeddings:
             provider (str): The provider of embeddings, e.g., "openai", "huggingface_bge". Defaults to "huggingface_bge".
             model_name (str): The model name for the embeddings. Defaults to None.
         """
+        self.provider = provider
         self.embeddings = self._load_embedding_model(provider, model_name)
+        self._token_counter = None
 
     def _load_embedding_model(self, provider: str, model_name: str) -> Embeddings:
         """
@@ -62,3 +67,83 @@ class CustomEmbeddings:
         Returns the embedding function
         """
         return self.embeddings
+
+    def get_model_identity(self) -> Dict[str, str]:
+        """
+        Returns the provider and model name of the embeddings, to check that stored vectors are compatible.
+        """
+        model_name = getattr(self.embeddings, "model", None) or getattr(
+            self.embeddings, "model_name", None
+        )
+        return {"provider": str(self.provider), "model_name": str(model_name)}
+
+    def get_token_counter(self) -> Callable[[str], int]:
+        """
+        Returns a function that counts the tokens of a text with the tokenizer of the embedding model
+        (e.g., to size chunks in tokens). If the tokenizer is not available, tokens are estimated.
+        """
+        if self._token_counter is None:
+            self._token_counter = self._load_token_counter()
+        return self._token_counter
+
+    def _load_token_counter(self) -> Callable[[str], int]:
+        if self.provider == EmbeddingProvider.OPENAI:
+            return get_token_counter(
+                model=self.embeddings.model, fallback_encoding="cl100k_base"
+            )
+        try:
+            tokenizer = self.embeddings.client.tokenizer
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception as e:
+            logger.warning(f"Could not load the tokenizer of the embedding model: {e}")
+            logger.warning(
+                "Token counts will be estimated from the number of characters."
+            )
+        return get_token_counter()
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(
+    model: Optional[str] = None, fallback_encoding: str = "cl100k_base"
+) -> Callable[[str], int]:
+    """
+    Returns a function that counts the tokens of a text with the tiktoken encoding of an OpenAI model
+    (or with fallback_encoding, if tiktoken does not know the model). Without a model, or if the encoding is not
+    available, tokens are estimated from the number of characters. The counters are loaded once per process.
+    """
+    if model is not None:
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding(fallback_encoding)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"Could not load the tokenizer of '{model}': {e}")
+            logger.warning(
+                "Token counts will be estimated from the number of characters."
+            )
+
+    # Rough estimation (~4 characters per token)
+    return lambda text: len(text) // 4
+
+
+_embeddings: Dict[Tuple[Optional[str], Optional[str]], CustomEmbeddings] = {}
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings(provider: str = None, model_name: str = None) -> CustomEmbeddings:
+    """
+    Returns the embeddings of a provider and model. They are shared within the process, so that the model is
+    only loaded once, and not on every request. When the server is preloaded before forking its workers,
+    the model is loaded by the parent process and its memory is shared by all the workers.
+    """
+    key = (provider, model_name)
+    with _embeddings_lock:
+        if key not in _embeddings:
+            _embeddings[key] = CustomEmbeddings(
+                provider=provider, model_name=model_name
+            )
+        return _embeddings[key]
@@ -0,0 +1,440 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import openai
+from langchain_openai import ChatOpenAI
+
+from src.modules.profiling import propagate_profiling
+from src.modules.rag.embeddings import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the call to the LLM can be retried
+RETRIABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    TimeoutError,
+)
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM could not generate an answer before the deadline."""
+
+    def __init__(self, message: str, retry_after: float = 5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, used to keep the number of tokens sent to the LLM provider per minute under a limit.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        """
+        Initialize the token bucket. The bucket starts full.
+
+        Args:
+            tokens_per_minute (int): Max number of tokens per minute (capacity of the bucket).
+        """
+        self.capacity = float(tokens_per_minute)
+        self.refill_rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int, deadline: float) -> bool:
+        """
+        Take tokens from the bucket, waiting until they are available.
+
+        Args:
+            tokens (int): Number of tokens to take. It is capped to the capacity of the bucket.
+            deadline (float): Max time to wait (time.monotonic() value).
+
+        Returns:
+            bool: True if the tokens were taken, False if the deadline was reached.
+        """
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait_time = (tokens - self.tokens) / self.refill_rate
+            if time.monotonic() + wait_time > deadline:
+                return False
+            time.sleep(wait_time)
+
+    def consume(self, tokens: int):
+        """
+        Take tokens from the bucket without waiting (e.g., to correct an estimation). The bucket can go into debt.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate
+        )
+        self.updated_at = now
+
+
+class ResponseCache:
+    """
+    Disk cache of LLM responses, indexed by the hash of the model name and the exact prompt.
+    Responses expire after a TTL, and the oldest ones are removed when the cache exceeds its max number of entries.
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 86400.0, max_entries: int = 10000):
+        """
+        Initialize the response cache.
+
+        Args:
+            cache_dir (str): Directory where the responses are stored.
+            ttl (float, optional): Time to live of the responses, in seconds. 0 means no expiration. Defaults to 1 day.
+            max_entries (int, optional): Max number of responses kept. 0 means no limit. Defaults to 10000.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._n_entries = len(self._list_entries())
+        self._lock = threading.Lock()
+
+    def get_key(self, model: str, prompt: str) -> str:
+        return hashlib.sha256(
+            json.dumps({"model": model, "prompt": prompt}).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r") as f:
+                return json.load(f).get("response")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, response: str):
+        # Write to a temporary file first, so that readers never see a partially written response
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"response": response}, f)
+        is_new = not os.path.exists(path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._n_entries += is_new
+            if self.max_entries and self._n_entries > self.max_entries:
+                self._prune()
+
+    def _prune(self):
+        """Removes the expired responses, and then the oldest ones until the cache is under its max size."""
+        entries = []
+        for path in self._list_entries():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        now = time.time()
+        n_removed = 0
+        for i, (modified_at, path) in enumerate(entries):
+            expired = self.ttl and now - modified_at > self.ttl
+            if not expired and len(entries) - i <= self.max_entries:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            n_removed += 1
+        self._n_entries = len(entries) - n_removed
+        logger.debug(f"Removed {n_removed} responses from the LLM cache")
+
+    def _list_entries(self) -> List[str]:
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(".json")
+        ]
+
+
+class LLMClient:
+    """
+    Resilient client for calling an OpenAI LLM.
+
+    Every call has a deadline, and failed calls (timeouts, rate limits, connection or server errors)
+    are retried with jittered exponential backoff. Optionally:
+        - A second (hedged) request is sent if the first one is slower than the recent latency percentile.
+        - A token bucket limits the number of tokens sent per minute.
+        - Responses are cached on disk by prompt hash.
+    """
+
+    def __init__(
+        self,
+        model: str = "gpt-4o",
+        base_url: Optional[str] = None,
+        timeout: float = 30.0,
+        deadline: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedging: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        tokens_per_minute: int = 0,
+        cache_dir: Optional[str] = None,
+        cache_ttl: float = 86400.0,
+        cache_max_entries: int = 10000,
+        max_concurrency: int = 8,
+    ):
+        """
+        Initialize the LLM client.
+
+        Args:
+            model (str, optional): OpenAI model name. Defaults to "gpt-4o".
+            base_url (Optional[str], optional): Base URL of an OpenAI compatible API (e.g., a stub server). Defaults to None.
+            timeout (float, optional): Timeout of each individual request, in seconds. Defaults to 30.
+            deadline (float, optional): Max total time for a call, including retries, in seconds. Defaults to 60.
+            max_retries (int, optional): Max number of retries after a failed request. Defaults to 3.
+            backoff_base (float, optional): Base of the exponential backoff, in seconds. Defaults to 0.5.
+            backoff_max (float, optional): Max backoff between retries, in seconds. Defaults to 8.
+            hedging (bool, optional): Whether to send hedged requests. Defaults to False.
+            hedge_percentile (float, optional): Latency percentile after which a hedged request is sent. Defaults to 95.
+            hedge_min_samples (int, optional): Min number of latency samples before hedging. Defaults to 20.
+            tokens_per_minute (int, optional): Max number of tokens per minute. 0 means no limit. Defaults to 0.
+            cache_dir (Optional[str], optional): Directory for caching responses. None means no cache. Defaults to None.
+            cache_ttl (float, optional): Time to live of the cached responses, in seconds. Defaults to 1 day.
+            cache_max_entries (int, optional): Max number of cached responses. Defaults to 10000.
+            max_concurrency (int, optional): Max number of concurrent requests to the LLM provider. Defaults to 8.
+        """
+        self.model = model
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        # Retries are managed by this client, not by the OpenAI SDK
+        self.llm = ChatOpenAI(
+            model=model, base_url=base_url, timeout=timeout, max_retries=0
+        )
+        self.rate_limiter = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.cache = (
+            ResponseCache(cache_dir, ttl=cache_ttl, max_entries=cache_max_entries)
+            if cache_dir
+            else None
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="llm"
+        )
+        self.latencies = deque(maxlen=500)
+        self._latencies_lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        """
+        Send a prompt to the LLM and return the text of the answer.
+
+        Raises:
+            LLMUnavailableError: if no answer could be generated before the deadline.
+        """
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.get_key(model=self.model, prompt=prompt)
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug(f"LLM response found in cache ({cache_key})")
+                return cached_response
+
+        deadline = time.monotonic() + self.deadline
+        estimated_tokens = self._estimate_tokens(prompt)
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter and not self.rate_limiter.acquire(
+                estimated_tokens, deadline=deadline
+            ):
+                raise LLMUnavailableError(
+                    "The LLM token rate limit has been reached. Try again later."
+                )
+
+            try:
+                message = self._call_with_hedging(
+                    prompt=prompt, deadline=deadline, estimated_tokens=estimated_tokens
+                )
+            except RETRIABLE_ERRORS as e:
+                last_error = e
+                backoff = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2**attempt)
+                )
+                backoff = max(backoff, self._get_retry_after(e))
+                logger.warning(
+                    f"LLM request failed (attempt {attempt + 1}/{self.max_retries + 1}): {e!r}"
+                )
+                if (
+                    attempt == self.max_retries
+                    or time.monotonic() + backoff >= deadline
+                ):
+                    break
+                logger.debug(f"Retrying LLM request in {backoff:.2f}s")
+                time.sleep(backoff)
+                continue
+
+            # Correct the estimation of the tokens consumed with the actual usage
+            usage = getattr(message, "usage_metadata", None) or {}
+            if self.rate_limiter and usage.get("total_tokens"):
+                self.rate_limiter.consume(usage["total_tokens"] - estimated_tokens)
+
+            if self.cache:
+                self.cache.put(cache_key, message.content)
+            return message.content
+
+        raise LLMUnavailableError(
+            f"The LLM could not generate an answer: {last_error!r}",
+            retry_after=self._get_retry_after(last_error) or 5.0,
+        )
+
+    def get_stats(self) -> Dict:
+        """
+        Returns statistics about the latency of the recent requests.
+        """
+        return {
+            "n_samples": len(self.latencies),
+            "hedge_delay": self._get_hedge_delay(),
+        }
+
+    def _call_with_hedging(self, prompt: str, deadline: float, estimated_tokens: int):
+        """
+        Send the request to the LLM. If hedging is enabled and the request takes longer than
+        the latency percentile, a second identical request is sent and the first answer is used.
+        The hedged request takes its tokens from the rate limiter, and it is not sent if they are not available.
+        """
+        start = time.monotonic()
+        # The LLM requests are sent from pool threads, which are sampled with the request if it is profiled
+        invoke = propagate_profiling(self.llm.invoke)
+        futures = {self.executor.submit(invoke, prompt)}
+
+        hedge_delay = self._get_hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(futures, timeout=min(hedge_delay, deadline - start))
+            if not done and time.monotonic() < deadline:
+                if self.rate_limiter and not self.rate_limiter.acquire(
+                    estimated_tokens, deadline=time.monotonic()
+                ):
+                    logger.debug("LLM token rate limit reached. Not hedging.")
+                else:
+                    logger.debug(
+                        f"LLM request slower than {hedge_delay:.2f}s. Hedging."
+                    )
+                    futures.add(self.executor.submit(invoke, prompt))
+
+        error = None
+        while futures:
+            done, futures = wait(
+                futures,
+                timeout=max(0.0, deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    self._cancel(futures)
+                    self._record_latency(time.monotonic() - start)
+                    return future.result()
+
+        self._cancel(futures)
+        if error is not None:
+            raise error
+        raise TimeoutError("The LLM request did not finish before the deadline")
+
+    def _get_hedge_delay(self) -> Optional[float]:
+        """Returns the latency percentile after which a request is hedged, or None if hedging is not possible."""
+        if not self.hedging:
+            return None
+        with self._latencies_lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(
+            len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100)
+        )
+        return latencies[index]
+
+    def _record_latency(self, latency: float):
+        with self._latencies_lock:
+            self.latencies.append(latency)
+
+    @staticmethod
+    def _cancel(futures: set[Future]):
+        # Requests that are already running cannot be cancelled. They finish when their timeout expires.
+        for future in futures:
+            future.cancel()
+
+    @staticmethod
+    def _estimate_tokens(prompt: str) -> int:
+        # Rough estimation of the prompt tokens, plus room for the answer
+        return get_token_counter()(prompt) + 500
+
+    @staticmethod
+    def _get_retry_after(error: Optional[Exception]) -> float:
+        """Returns the value of the Retry-After header of an API error, if available."""
+        response = getattr(error, "response", None)
+        if response is None:
+            return 0.0
+        try:
+            return float(response.headers.get("retry-after", 0))
+        except (TypeError, ValueError):
+            return 0.0
+
+
+_llm_clients: Dict[str, LLMClient] = {}
+_llm_clients_lock = threading.Lock()
+
+
+def get_llm_client(model: Optional[str] = None) -> LLMClient:
+    """
+    Returns the LLM client for a model, configured with the environment variables.
+    Clients are shared between queries, so that latency statistics and rate limits are global.
+
+    Args:
+        model (Optional[str], optional): OpenAI model name. Defaults to the OPENAI_MODEL env variable.
+    """
+    model = model or os.getenv("OPENAI_MODEL", "gpt-4o")
+    with _llm_clients_lock:
+        if model not in _llm_clients:
+            _llm_clients[model] = LLMClient(
+                model=model,
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+                deadline=float(os.getenv("LLM_DEADLINE", 60)),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+                hedging=os.getenv("LLM_HEDGING", "False").lower() == "true",
+                hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 95)),
+                tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", 0)),
+                cache_dir=os.getenv("LLM_CACHE_DIR") or None,
+                cache_ttl=float(os.getenv("LLM_CACHE_TTL", 86400)),
+                cache_max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000)),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+            )
+        return _llm_clients[model]
@@ -26,3 +26,18 @@ The information is divided into three sections: Memory, Context, and Question.
 
 ## Your Answer:
 """
+
+CONDENSE_QUESTION_PROMPT_TEMPLATE = """
+Rewrite the user's last question as a standalone question, using the previous interactions of the conversation.
+The standalone question must be understandable without the conversation: replace pronouns and references
+(e.g., "it", "that airline", "what about...") with what they refer to, and keep the airline names.
+If the question is already standalone, return it unchanged. Do not answer the question.
+
+## Previous Interactions:
+{memory}
+
+## User's Last Question:
+{question}
+
+## Standalone Question:
+"""
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import openai
+from langchain.prompts import ChatPromptTemplate
+
+from src.modules.rag.llm_client import LLMUnavailableError, get_llm_client
+from src.modules.rag.prompts import CONDENSE_QUESTION_PROMPT_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+# Openings of follow-up questions, which are removed when the question is appended to the previous one
+FOLLOW_UP_PREFIXES = re.compile(
+    r"^\s*(what about|how about|and what about|and how about|what if|and|also|same for|but)\b[\s,]*",
+    re.IGNORECASE,
+)
+
+# Words that refer to something mentioned earlier in the conversation
+REFERRING_WORDS = {
+    "it",
+    "its",
+    "they",
+    "them",
+    "their",
+    "those",
+    "these",
+    "same",
+}
+
+# Words that refer to something in the previous answer ("the second one", "is that refundable?"), which the
+# rules cannot resolve from the previous question
+ANSWER_REFERRING_WORDS = {
+    "one",
+    "ones",
+    "that",
+    "this",
+    "other",
+    "former",
+    "latter",
+}
+
+# Words that can surround an airline in a follow-up question ("and for Delta?")
+AIRLINE_FOLLOW_UP_WORDS = {"for", "on", "with", "at", "in", "about", "and", "or", "the"}
+
+# Max number of characters of each previous answer included in the condensation prompt
+MAX_ANSWER_LENGTH = 500
+
+
+class QueryCondenser:
+    """
+    Rewrites follow-up questions ("what about for pets?") as standalone questions, using the chat memory,
+    so that they can be used for retrieval and cached like single-turn questions.
+
+    Two modes are available:
+    - "rules": local rules, without any LLM call. Questions that start like a follow-up are appended to the
+      previous question, and questions with references ("it", "they"...) are completed with the previous question.
+      Follow-ups that only name another airline ("what about Delta?") get the previous question, about that
+      airline. Other questions that name an airline are considered standalone. Questions that the rules cannot
+      rewrite safely (e.g., "why?", "is that refundable?") are returned unchanged, so that the caller keeps
+      answering them with the chat memory.
+    - "llm": a (cheap) LLM rewrites the question from the recent interactions. If it is not available, the
+      rules are used.
+
+    Rewrites are cached in memory by (hash of the memory used, question).
+    """
+
+    def __init__(
+        self,
+        mode: str = "rules",
+        model: Optional[str] = None,
+        memory_turns: int = 2,
+        max_cache_size: int = 1024,
+    ):
+        """
+        Initialize the query condenser.
+
+        Args:
+            mode (str, optional): "rules" or "llm". Defaults to "rules".
+            model (Optional[str], optional): LLM used to rewrite the questions, in "llm" mode.
+                Defaults to the OPENAI_MODEL env variable.
+            memory_turns (int, optional): Number of recent interactions used to rewrite the questions,
+                in "llm" mode. Defaults to 2.
+            max_cache_size (int, optional): Max number of rewrites kept in the cache. Defaults to 1024.
+        """
+        if mode not in ("rules", "llm"):
+            raise ValueError(
+                f"Unsupported condensation mode: '{mode}'. Must be one of: ['rules', 'llm']."
+            )
+        self.mode = mode
+        self.model = model
+        self.memory_turns = memory_turns
+        self.max_cache_size = max_cache_size
+
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def condense(
+        self, question: str, memory: List[Optional[Dict]], airlines: List[str] = []
+    ) -> str:
+        """
+        Returns the standalone version of a question, given the chat memory.
+
+        Args:
+            question (str): question of the user.
+            memory (List[Optional[Dict]]): chat memory, given as a list of dictionaries (fields "question", "answer").
+                It must contain the questions asked by the user, not their rewritten versions, so that the rewrites
+                of consecutive follow-ups do not get longer and longer.
+            airlines (List[str], optional): airlines available in the database. Defaults to [].
+
+        Returns:
+            str: the standalone question (the question itself if there is no memory, or if it could not be
+                rewritten).
+        """
+        memory = [qa for qa in memory if qa]
+        if not memory:
+            return question
+        if self.mode == "llm":
+            turns = self.memory_turns
+            memory = memory[-turns:]
+        else:
+            # The rules only use the previous question that was not a follow-up itself
+            memory = [{"question": self._get_last_standalone_question(memory)}]
+
+        key = self._get_key(question=question, memory=memory, airlines=airlines)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        if self.mode == "llm":
+            standalone_question = self._condense_with_llm(
+                question=question, memory=memory, airlines=airlines
+            )
+        else:
+            standalone_question = self._condense_with_rules(
+                question=question,
+                previous_question=memory[-1]["question"],
+                airlines=airlines,
+            )
+        if standalone_question != question:
+            logger.info(f"Follow-up question rewritten as: '{standalone_question}'")
+
+        with self._lock:
+            self._cache[key] = standalone_question
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+        return standalone_question
+
+    def get_stats(self) -> Dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def _condense_with_rules(
+        question: str, previous_question: str, airlines: List[str]
+    ) -> str:
+        """Completes a follow-up question with the previous question. Other questions are returned unchanged."""
+        previous_question = previous_question.strip()
+        match = FOLLOW_UP_PREFIXES.match(question)
+        remainder = FOLLOW_UP_PREFIXES.sub("", question, count=1).strip()
+        words = set(re.findall(r"[a-z]+", question.lower()))
+
+        # References to the previous answer cannot be resolved from the previous question
+        if words & ANSWER_REFERRING_WORDS:
+            return question
+
+        mentioned_airlines = _find_airlines(text=question, airlines=airlines)
+        if mentioned_airlines:
+            # "How much is a checked bag on Delta?" + "what about United?"
+            # -> "How much is a checked bag on United?"
+            other_text = remainder
+            for airline in mentioned_airlines:
+                other_text = _get_airline_pattern(airline).sub(" ", other_text)
+            other_words = set(re.findall(r"[a-z]+", other_text.lower()))
+            if match and other_words <= AIRLINE_FOLLOW_UP_WORDS:
+                return _replace_airline(
+                    question=previous_question,
+                    airline=remainder.rstrip("?.! "),
+                    airlines=airlines,
+                )
+            # Other questions that name an airline do not depend on the previous one
+            return question
+
+        if match and remainder:
+            # "What is the baggage allowance on Delta?" + "what about for pets?"
+            # -> "What is the baggage allowance on Delta for pets?"
+            return f"{previous_question.rstrip('?.! ')} {remainder}"
+
+        if words & REFERRING_WORDS:
+            return f"{question.strip()} (follow-up to: {previous_question})"
+        return question
+
+    @staticmethod
+    def _get_last_standalone_question(memory: List[Dict]) -> str:
+        """Returns the last question of the memory that is not a follow-up (or the last question, if all are)."""
+        for qa in reversed(memory):
+            question = qa["question"]
+            words = set(re.findall(r"[a-z]+", question.lower()))
+            if (
+                not FOLLOW_UP_PREFIXES.match(question)
+                and not words & REFERRING_WORDS
+                and not words & ANSWER_REFERRING_WORDS
+            ):
+                return question
+        return memory[-1]["question"]
+
+    def _condense_with_llm(
+        self, question: str, memory: List[Dict], airlines: List[str]
+    ) -> str:
+        """Rewrites a question with an LLM. The rules are used if the LLM is not available."""
+        memory_text = "\n".join(
+            f"- **Q:** {qa['question']}\n  **A:** {qa['answer'][:MAX_ANSWER_LENGTH]}"
+            for qa in memory
+        )
+        prompt = ChatPromptTemplate.from_template(
+            CONDENSE_QUESTION_PROMPT_TEMPLATE
+        ).format(memory=memory_text, question=question)
+        try:
+            standalone_question = (
+                get_llm_client(model=self.model).invoke(prompt).strip().strip('"')
+            )
+        except (LLMUnavailableError, openai.OpenAIError) as e:
+            # Non-retriable errors (e.g., unknown model, invalid key) are not fatal either: the rules are used
+            logger.warning(f"The question could not be rewritten by the LLM: {e}")
+            standalone_question = ""
+
+        if not standalone_question:
+            return self._condense_with_rules(
+                question=question,
+                previous_question=memory[-1]["question"],
+                airlines=airlines,
+            )
+        return standalone_question
+
+    @staticmethod
+    def _get_key(question: str, memory: List[Dict], airlines: List[str]) -> str:
+        memory_hash = hashlib.sha256(
+            json.dumps([memory, sorted(airlines)], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return f"{memory_hash}:{' '.join(question.lower().split())}"
+
+
+def _get_airline_pattern(airline: str) -> re.Pattern:
+    """Matches an airline in a text, ignoring the case and the spaces ("AmericanAirlines", "American Airlines")."""
+    letters = airline.replace(" ", "")
+    return re.compile(
+        r"\s*".join(re.escape(letter) for letter in letters), re.IGNORECASE
+    )
+
+
+def _find_airlines(text: str, airlines: List[str]) -> List[str]:
+    """Returns the airlines named in a text."""
+    return [
+        airline for airline in airlines if _get_airline_pattern(airline).search(text)
+    ]
+
+
+def _replace_airline(question: str, airline: str, airlines: List[str]) -> str:
+    """Asks a question about another airline: the airline named in the question is replaced. If the question
+    does not name any airline, the new one is appended. Questions that name several airlines are unchanged.
+    """
+    previous_airlines = _find_airlines(text=question, airlines=airlines)
+    if len(previous_airlines) > 1:
+        return question
+    airline = re.sub(r"^(for|on|with|at|in|about)\s+", "", airline, flags=re.IGNORECASE)
+    if not previous_airlines:
+        return f"{question.rstrip('?.! ')} for {airline}?"
+    return _get_airline_pattern(previous_airlines[0]).sub(
+        lambda _: airline, question, count=1
+    )
+
+
+# Condenser used by the query service (None if the condensation is disabled)
+_condensation_mode = os.getenv("QUERY_CONDENSATION", "off").lower()
+query_condenser = (
+    QueryCondenser(
+        mode=_condensation_mode,
+        model=os.getenv("CONDENSE_MODEL") or None,
+        memory_turns=int(os.getenv("CONDENSE_MEMORY_TURNS", 2)),
+        max_cache_size=int(os.getenv("CONDENSE_CACHE_SIZE", 1024)),
+    )
+    if _condensation_mode != "off"
+    else None
+)
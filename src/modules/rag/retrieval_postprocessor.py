@@ -0,0 +1,163 @@
+import logging
+import os
+from typing import List, Tuple
+
+import numpy as np
+from langchain.schema.document import Document
+
+from src.modules.rag.embeddings import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalPostProcessor:
+    """
+    Post-processor of the chunks retrieved from the vector DB, to reduce the size of the prompt sent to the LLM.
+
+    1. Adaptive top-k: the candidates are cut where the similarity to the query drops by more than a given gap
+       between two consecutive chunks, or below a given fraction of the similarity of the best chunk.
+    2. Maximal marginal relevance (MMR): up to k chunks are selected greedily among the remaining candidates,
+       balancing their similarity to the query and to the chunks already selected. Chunks almost identical to
+       an already selected one are dropped, so that a diverse candidate ranked after the top k can replace them.
+
+    Similarities are computed (cosine) from the embeddings returned by the vector DB, so no embeddings are
+    recomputed.
+    """
+
+    def __init__(
+        self,
+        k: int,
+        score_gap: float = 0.0,
+        relative_threshold: float = 0.0,
+        mmr_lambda: float = 1.0,
+        redundancy_threshold: float = 1.0,
+        min_k: int = 1,
+    ):
+        """
+        Initialize the post-processor.
+
+        Args:
+            k (int): Max number of chunks to keep.
+            score_gap (float, optional): Cut the results after the first drop of similarity to the query greater
+                than this value, between two consecutive chunks. 0 means no cut. Defaults to 0.
+            relative_threshold (float, optional): Drop chunks whose similarity to the query is lower than this
+                fraction (between 0 and 1) of the similarity of the best chunk. 0 means no cut. Defaults to 0.
+            mmr_lambda (float, optional): Weight (between 0 and 1) of the similarity to the query in MMR,
+                against the diversity of the chunks. 1 means ranking only by similarity. Defaults to 1.
+            redundancy_threshold (float, optional): Drop chunks whose similarity to an already selected chunk is
+                greater or equal than this value. 1 means only exact duplicates are dropped. Defaults to 1.
+            min_k (int, optional): Min number of chunks to keep after the cuts. Defaults to 1.
+        """
+        self.k = k
+        self.score_gap = score_gap
+        self.relative_threshold = relative_threshold
+        self.mmr_lambda = mmr_lambda
+        self.redundancy_threshold = redundancy_threshold
+        self.min_k = min_k
+
+    @classmethod
+    def from_env(cls, k: int) -> "RetrievalPostProcessor":
+        """Creates a post-processor with the parameters defined in the environment variables."""
+        return cls(
+            k=k,
+            score_gap=float(os.getenv("RETRIEVAL_SCORE_GAP", 0.0)),
+            relative_threshold=float(os.getenv("RETRIEVAL_RELATIVE_THRESHOLD", 0.0)),
+            mmr_lambda=float(os.getenv("RETRIEVAL_MMR_LAMBDA", 1.0)),
+            redundancy_threshold=float(
+                os.getenv("RETRIEVAL_REDUNDANCY_THRESHOLD", 1.0)
+            ),
+            min_k=int(os.getenv("RETRIEVAL_MIN_K", 1)),
+        )
+
+    def process(
+        self,
+        query_embedding: List[float],
+        results: List[Tuple[Document, float, List[float]]],
+    ) -> List[Tuple[Document, float]]:
+        """
+        Selects the chunks to send to the LLM among the retrieved ones.
+
+        Args:
+            query_embedding (List[float]): embedding of the query.
+            results (List[Tuple[Document, float, List[float]]]): retrieved chunks, with their distance to the
+                query and their embedding, sorted by distance.
+
+        Returns:
+            List[Tuple[Document, float]]: selected chunks and their distance to the query, in order of selection.
+        """
+        if not results:
+            return []
+
+        embeddings = _normalize(np.asarray([result[2] for result in results]))
+        query_similarities = embeddings @ _normalize(np.asarray(query_embedding))
+
+        # Sort by similarity, since the distance of the vector DB may use a different metric
+        candidates = np.argsort(-query_similarities, kind="stable")
+        candidates = candidates[: self._get_cutoff(query_similarities[candidates])]
+        selected = self._select_mmr(
+            candidates=candidates,
+            query_similarities=query_similarities,
+            similarities=embeddings @ embeddings.T,
+        )
+
+        # Compared to the top k chunks, which are sent to the LLM without post-processing
+        n_top_k = min(self.k, len(results))
+        n_dropped = n_top_k - len(selected)
+        if n_dropped > 0:
+            estimate_tokens = get_token_counter()
+            saved_tokens = sum(
+                estimate_tokens(doc.page_content) for doc, _, _ in results[:n_top_k]
+            ) - sum(estimate_tokens(results[i][0].page_content) for i in selected)
+            logger.info(
+                f"Retrieval post-processing dropped {n_dropped}/{n_top_k} chunks (~{saved_tokens} tokens)."
+            )
+        return [(results[i][0], results[i][1]) for i in selected]
+
+    def _get_cutoff(self, sorted_similarities: np.ndarray) -> int:
+        """Returns the number of candidates kept by the score gap and relative threshold cuts (MMR selects
+        at most k chunks among them)."""
+        cutoff = len(sorted_similarities)
+        if self.score_gap > 0:
+            gaps = sorted_similarities[:-1] - sorted_similarities[1:]
+            large_gaps = np.flatnonzero(gaps > self.score_gap)
+            if large_gaps.size:
+                cutoff = min(cutoff, int(large_gaps[0]) + 1)
+        if self.relative_threshold > 0:
+            threshold = self.relative_threshold * sorted_similarities[0]
+            cutoff = min(cutoff, int(np.sum(sorted_similarities >= threshold)))
+        return max(cutoff, min(self.min_k, len(sorted_similarities)))
+
+    def _select_mmr(
+        self,
+        candidates: np.ndarray,
+        query_similarities: np.ndarray,
+        similarities: np.ndarray,
+    ) -> List[int]:
+        """Selects chunks greedily by maximal marginal relevance, dropping redundant ones."""
+        selected = [int(candidates[0])]
+        remaining = candidates[1:]
+        while remaining.size and len(selected) < self.k:
+            # Max similarity of each remaining chunk to the chunks already selected
+            redundancy = similarities[np.ix_(remaining, selected)].max(axis=1)
+
+            # Chunks almost identical to a selected one are dropped, as long as the min number is kept
+            if len(selected) >= self.min_k:
+                remaining = remaining[redundancy < self.redundancy_threshold]
+                redundancy = redundancy[redundancy < self.redundancy_threshold]
+                if not remaining.size:
+                    break
+
+            scores = (
+                self.mmr_lambda * query_similarities[remaining]
+                - (1 - self.mmr_lambda) * redundancy
+            )
+            best = int(np.argmax(scores))
+            selected.append(int(remaining[best]))
+            remaining = np.delete(remaining, best)
+        return selected
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normalizes vectors (along the last axis) to unit length."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
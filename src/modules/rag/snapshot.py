@@ -0,0 +1,218 @@
+# Standard imports
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import time
+from typing import Dict, Optional
+
+# Third party imports
+import numpy as np
+
+# Local imports
+from src.modules.rag.document_table import get_file_hash
+from src.modules.rag.vector_db import VectorDB
+
+logger = logging.getLogger(__name__)
+
+# Version of the snapshot format. Snapshots with a higher version cannot be imported.
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Files inside the snapshot bundle
+MANIFEST_FILE = "manifest.json"
+RECORDS_FILE = "records.jsonl"
+VECTORS_FILE = "vectors.f32"
+
+
+def export_snapshot(
+    vector_db: VectorDB, snapshot_path: str, batch_size: int = 1000
+) -> Dict:
+    """Exports the content of the vector DB into a portable snapshot bundle.
+
+    The bundle is a gzip-compressed tar file containing:
+        - records.jsonl: one line per chunk, with its id, text and metadata.
+        - vectors.f32: the embeddings of the chunks (little-endian float32), in the same order.
+        - manifest.json: format version, embedding model identity, ingestion manifest (chunks per source file)
+          and the SHA-256 checksums of the other files.
+
+    Args:
+        vector_db (VectorDB): vector DB to export.
+        snapshot_path (str): path of the bundle to create (e.g., "snapshots/index.tar.gz").
+        batch_size (int, optional): number of chunks read from the DB at once. Defaults to 1000.
+
+    Returns:
+        Dict: the manifest of the snapshot.
+    """
+    logger.info(f"Exporting snapshot of the vector database to '{snapshot_path}'")
+    sources = {}
+    n_items, dimension = 0, None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        records_path = os.path.join(tmp_dir, RECORDS_FILE)
+        vectors_path = os.path.join(tmp_dir, VECTORS_FILE)
+        records_hash, vectors_hash = hashlib.sha256(), hashlib.sha256()
+
+        with open(records_path, "wb") as records_file, open(
+            vectors_path, "wb"
+        ) as vectors_file:
+            for items in vector_db.iter_items(batch_size=batch_size):
+                for item in items:
+                    record = json.dumps(
+                        {
+                            "id": item["id"],
+                            "page_content": item["page_content"],
+                            "metadata": item["metadata"],
+                        }
+                    ).encode("utf-8")
+                    records_file.write(record + b"\n")
+                    records_hash.update(record + b"\n")
+
+                    # Keep count of the chunks of each source file (ingestion manifest)
+                    metadata = item["metadata"] or {}
+                    source = sources.setdefault(
+                        metadata.get("source", ""),
+                        {
+                            "parent_folder": metadata.get("parent_folder", ""),
+                            "extension": metadata.get("extension", ""),
+                            "hash": _get_document_hash(
+                                vector_db=vector_db, source=metadata.get("source", "")
+                            ),
+                            "n_chunks": 0,
+                        },
+                    )
+                    source["n_chunks"] += 1
+
+                vectors = np.asarray([item["embedding"] for item in items], dtype="<f4")
+                if dimension is None:
+                    dimension = int(vectors.shape[1])
+                vectors_file.write(vectors.tobytes())
+                vectors_hash.update(vectors.tobytes())
+                n_items += len(items)
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "embedding_model": vector_db.embeddings.get_model_identity(),
+            "dimension": dimension,
+            "n_items": n_items,
+            "sources": sources,
+            "checksums": {
+                RECORDS_FILE: records_hash.hexdigest(),
+                VECTORS_FILE: vectors_hash.hexdigest(),
+            },
+        }
+        manifest_path = os.path.join(tmp_dir, MANIFEST_FILE)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Write the bundle to a temporary file first, so that a partial snapshot is never left behind
+        os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+        tmp_snapshot_path = f"{snapshot_path}.tmp"
+        with tarfile.open(tmp_snapshot_path, "w:gz") as tar:
+            for path in [manifest_path, records_path, vectors_path]:
+                tar.add(path, arcname=os.path.basename(path))
+        os.replace(tmp_snapshot_path, snapshot_path)
+
+    logger.info(f"Snapshot with {n_items} chunks exported to '{snapshot_path}'")
+    return manifest
+
+
+def import_snapshot(
+    vector_db: VectorDB, snapshot_path: str, force: bool = False, batch_size: int = 1000
+) -> Dict:
+    """Imports a snapshot bundle created with export_snapshot into the vector DB.
+    The stored embeddings are used as they are, so no embedding computation is needed.
+
+    Args:
+        vector_db (VectorDB): vector DB where the chunks are imported.
+        snapshot_path (str): path of the bundle.
+        force (bool, optional): import the snapshot even if it was created with a different embedding model.
+            Defaults to False.
+        batch_size (int, optional): number of chunks written to the DB at once. Defaults to 1000.
+
+    Returns:
+        Dict: the manifest of the snapshot.
+    """
+    logger.info(f"Importing snapshot of the vector database from '{snapshot_path}'")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with tarfile.open(snapshot_path, "r:gz") as tar:
+            members = {member.name: member for member in tar.getmembers()}
+            missing_files = {MANIFEST_FILE, RECORDS_FILE, VECTORS_FILE} - set(members)
+            if missing_files:
+                raise ValueError(
+                    f"Invalid snapshot. Missing files: {sorted(missing_files)}"
+                )
+            for name in [MANIFEST_FILE, RECORDS_FILE, VECTORS_FILE]:
+                tar.extract(members[name], path=tmp_dir)
+
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        _check_manifest(manifest=manifest, vector_db=vector_db, force=force)
+
+        # Verify the integrity of the files
+        for name, expected_checksum in manifest["checksums"].items():
+            checksum = get_file_hash(os.path.join(tmp_dir, name))
+            if checksum != expected_checksum:
+                raise ValueError(
+                    f"Invalid snapshot. Checksum mismatch for file '{name}'"
+                )
+
+        dimension = manifest["dimension"]
+        n_items = 0
+        with open(os.path.join(tmp_dir, RECORDS_FILE), "rb") as records_file, open(
+            os.path.join(tmp_dir, VECTORS_FILE), "rb"
+        ) as vectors_file:
+            while True:
+                records = [
+                    json.loads(line)
+                    for line in (records_file.readline() for _ in range(batch_size))
+                    if line
+                ]
+                if not records:
+                    break
+                vectors = np.frombuffer(
+                    vectors_file.read(len(records) * dimension * 4), dtype="<f4"
+                ).reshape(len(records), dimension)
+                for record, vector in zip(records, vectors):
+                    record["embedding"] = vector.tolist()
+                n_items += vector_db.add_embedded_items(items=records)
+
+    if n_items != manifest["n_items"]:
+        raise ValueError(
+            f"Invalid snapshot. Expected {manifest['n_items']} chunks, but {n_items} were found"
+        )
+
+    logger.info(f"Snapshot with {n_items} chunks imported from '{snapshot_path}'")
+    return manifest
+
+
+def _check_manifest(manifest: Dict, vector_db: VectorDB, force: bool):
+    """Checks that a snapshot can be imported into the vector DB."""
+    if manifest.get("format_version", 0) > SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot format version: {manifest.get('format_version')}. "
+            f"Max supported version: {SNAPSHOT_FORMAT_VERSION}"
+        )
+
+    # Vectors computed with a different model are not comparable with the query embeddings
+    snapshot_model = manifest.get("embedding_model")
+    current_model = vector_db.embeddings.get_model_identity()
+    if snapshot_model != current_model:
+        message = (
+            f"The snapshot was created with embedding model {snapshot_model}, "
+            f"but the current embedding model is {current_model}"
+        )
+        if not force:
+            raise ValueError(message)
+        logger.warning(f"{message}. Importing it anyway.")
+
+
+def _get_document_hash(vector_db: VectorDB, source: str) -> Optional[str]:
+    """Returns the hash of a source file recorded in the document table of the vector DB, if any."""
+    doc_id = vector_db.documents.get_doc_id(source)
+    if doc_id is None:
+        return None
+    return vector_db.documents.get(doc_id).get("hash")
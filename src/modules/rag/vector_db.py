@@ -1,30 +1,106 @@
+import hashlib
 import logging
 import os
+import re
 import shutil
-from typing import Dict, List, Optional, Union
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+from chromadb.api.shared_system_client import SharedSystemClient
 from langchain.schema.document import Document
 from langchain_chroma import Chroma
 
-from src.modules.rag.embeddings import CustomEmbeddings
+from src.modules.profiling import propagate_profiling
+from src.modules.rag.chunk_cache import chunk_cache
+from src.modules.rag.document_table import get_document_table
+from src.modules.rag.embeddings import get_embeddings
 
 logger = logging.getLogger(__name__)
 
+# Prefix of the names of the per-airline collections (shards), when the DB is partitioned
+SHARD_PREFIX = "airline_"
+
+# Metadata fields of the documents (files), stored in the document table instead of in every chunk
+DOCUMENT_FIELDS = ("source", "parent_folder", "extension")
+
+# Name of the file, inside the vector DB directory, that identifies the current version of the index
+INDEX_VERSION_FILE = "index_version"
+
+# Thread pool for searching multiple shards in parallel
+_shard_search_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SHARD_SEARCH_WORKERS", 8)),
+    thread_name_prefix="shard_search",
+)
+
+# Version of the index opened by this process, by vector DB directory
+_open_index_versions: Dict[str, Optional[str]] = {}
+# Vector DB directories modified by this process since their index version was last updated
+_modified_dirs = set()
+# Whether collections have chunks with the legacy metadata format, by (vector DB directory, collection name).
+# Checking it scans the whole collection, so it is only done again when the index changes
+_legacy_metadata_collections: Dict[Tuple[str, str], bool] = {}
+_open_index_versions_lock = threading.Lock()
+
+# Chroma clients (systems) replaced by a new one when their directory changed, with the time they were replaced.
+# They are stopped after a grace period, once the instances that were using them are done
+_retired_chroma_systems: List[Tuple[float, object]] = []
+_retired_chroma_systems_lock = threading.Lock()
+RETIRED_CHROMA_SYSTEM_GRACE_PERIOD = 60.0
+
 
 class VectorDB:
-    """Custom class for interacting with the Chroma Vector DB"""
+    """Custom class for interacting with the Chroma Vector DB
+
+    Chunks are stored with compact metadata: the fields of the document they belong to (source, airline,
+    extension) are stored once in a document table, and chunks only keep its integer "doc_id", their "order"
+    and their own fields (e.g., markdown "headers"). Metadata is expanded again when chunks are retrieved.
 
-    def __init__(self, persist_dir: str) -> None:
+    When several server workers share the same directory, only one process (the index writer) modifies it.
+    The other ones open it in read-only mode, and reopen it when the index version changes.
+    """
 
+    def __init__(
+        self,
+        persist_dir: str,
+        partitioned: Optional[bool] = None,
+        read_only: Optional[bool] = None,
+    ) -> None:
+        """Initialize VectorDB class
+
+        Args:
+            persist_dir (str): directory where the Chroma DB is persisted.
+            partitioned (Optional[bool], optional): whether chunks are stored in one collection per airline
+                ("parent_folder"), instead of a single collection. Defaults to the PARTITION_BY_AIRLINE env variable.
+            read_only (Optional[bool], optional): whether write operations are forbidden. Defaults to the
+                INDEX_READ_ONLY env variable.
+        """
         self.persist_dir = persist_dir
-        self.embeddings = CustomEmbeddings(
+        self.partitioned = (
+            partitioned
+            if partitioned is not None
+            else os.getenv("PARTITION_BY_AIRLINE", "False").lower() == "true"
+        )
+        self.read_only = (
+            read_only
+            if read_only is not None
+            else os.getenv("INDEX_READ_ONLY", "False").lower() == "true"
+        )
+        self.embeddings = get_embeddings(
             provider=os.getenv("EMBEDDINGS_PROVIDER"),
             model_name=os.getenv("EMBEDDINGS_MODEL"),
         )
+        # Table of indexed documents, referenced by the "doc_id" field of the chunks
+        self.documents = get_document_table(persist_dir=self.persist_dir)
+        refresh_if_index_changed(persist_dir=self.persist_dir)
         self.db = Chroma(
             persist_directory=self.persist_dir,
             embedding_function=self.embeddings.get_embedding_function(),
         )
+        # Per-airline collections, loaded on first use (only if the DB is partitioned)
+        self._shards: Optional[Dict[str, Chroma]] = None
 
     def index_documents(self, documents: List[List[Document]]) -> str:
         """Index a list of document chunks in the vector database
@@ -46,36 +122,307 @@ class VectorDB:
             f"There are {len(chunks)} chunks to be indexed in the vector database."
         )
 
+        n_new_chunks, n_uploaded_chunks = self.index_chunks(chunks=chunks)
+
+        if n_new_chunks:
+            message = f"{n_uploaded_chunks}/{n_new_chunks} chunks have been uploaded successfully"
+        else:
+            message = "There are no new chunks to add to the vector database."
+        logger.info(message)
+
+        return message
+
+    def index_chunks(self, chunks: List[Document]) -> Tuple[int, int]:
+        """Index a batch of chunks in the vector database. Chunks that already exist in the DB are skipped.
+
+        Args:
+            chunks (List[Document]): list of chunks, in Langchain's Document format.
+
+        Returns:
+            Tuple[int, int]: number of new chunks, and number of chunks that have been uploaded.
+        """
+        self._check_writable()
+        if not chunks:
+            return 0, 0
+
         # Calculate Page IDs.
         chunks = self._assign_chunk_ids(chunks=chunks)
 
+        # Group chunks by the collection they must be indexed in
+        if self.partitioned:
+            chunks_by_airline = {}
+            for chunk in chunks:
+                airline = chunk.metadata.get("parent_folder", "")
+                chunks_by_airline.setdefault(airline, []).append(chunk)
+            chunks_by_collection = [
+                (self._get_shard(airline=airline, create=True), airline_chunks)
+                for airline, airline_chunks in chunks_by_airline.items()
+            ]
+        else:
+            chunks_by_collection = [(self.db, chunks)]
+
+        n_new_chunks, n_uploaded_chunks = 0, 0
+        for collection, collection_chunks in chunks_by_collection:
+            n_new, n_uploaded = self._index_chunks_in_collection(
+                collection=collection, chunks=collection_chunks
+            )
+            n_new_chunks += n_new
+            n_uploaded_chunks += n_uploaded
+
+        return n_new_chunks, n_uploaded_chunks
+
+    def _index_chunks_in_collection(
+        self, collection: Chroma, chunks: List[Document]
+    ) -> Tuple[int, int]:
+        """Index chunks with assigned IDs in a collection. Chunks that already exist in the collection are skipped.
+
+        Returns:
+            Tuple[int, int]: number of new chunks, and number of chunks that have been uploaded.
+        """
         # Add or Update the documents.
-        existing_items = self.db.get(include=[])  # IDs are always included by default
+        # Only the IDs of the current chunks are looked up (IDs are always included by default)
+        chunk_ids = list(dict.fromkeys(chunk.metadata["id"] for chunk in chunks))
+        existing_items = collection.get(ids=chunk_ids, include=[])
         existing_ids = set(existing_items["ids"])
-        logger.debug(f"Number of existing items in DB: {len(existing_ids)}")
+        logger.debug(f"Number of chunks already in DB: {len(existing_ids)}")
 
         # Only add chunks that don't exist in the DB
         new_chunks = [
             chunk for chunk in chunks if chunk.metadata["id"] not in existing_ids
         ]
-        if new_chunks:
-            logger.info(f"Adding {len(new_chunks)} new items to the vector database.")
-            new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-            uploaded_ids = self.db.add_documents(
-                documents=new_chunks, ids=new_chunk_ids
+        if not new_chunks:
+            return 0, 0
+
+        logger.info(f"Adding {len(new_chunks)} new items to the vector database.")
+        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
+        chunk_cache.invalidate(ids=new_chunk_ids)
+        uploaded_ids = collection.add_documents(
+            documents=[
+                Document(
+                    page_content=chunk.page_content,
+                    metadata=self._compact_metadata(metadata=chunk.metadata),
+                )
+                for chunk in new_chunks
+            ],
+            ids=new_chunk_ids,
+        )
+        self._mark_modified()
+        if not uploaded_ids:
+            raise Exception(
+                "The documents could not be indexed in the vector database."
+            )
+
+        return len(new_chunks), len(uploaded_ids)
+
+    def update_metadata(self, metadatas: Dict[str, Dict]):
+        """Updates some metadata fields of items already indexed in the vector DB.
+        The embeddings of the items are not recomputed.
+
+        Args:
+            metadatas (Dict[str, Dict]): fields to update (values), by item ID (keys).
+        """
+        self._check_writable()
+        ids = list(metadatas.keys())
+        n_updated = 0
+        for collection, collection_ids in self._group_ids_by_collection(ids=ids):
+            existing_items = collection.get(ids=collection_ids, include=["metadatas"])
+            updated_metadatas = [
+                {**metadata, **metadatas[id]}
+                for id, metadata in zip(
+                    existing_items["ids"], existing_items["metadatas"]
+                )
+            ]
+            if updated_metadatas:
+                collection._collection.update(
+                    ids=existing_items["ids"], metadatas=updated_metadatas
+                )
+                self._mark_modified()
+            n_updated += len(updated_metadatas)
+        chunk_cache.invalidate(ids=ids)
+        logger.info(f"The metadata of {n_updated} items has been updated.")
+
+    def similarity_search_with_score(
+        self, query: str, k: int, filter: Optional[Dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Searches the k chunks most similar to a query.
+
+        If the DB is partitioned, an airline filter ({"parent_folder": {"$in": [...]}}) selects the shards
+        to search, instead of being applied as a metadata filter. Shards are searched in parallel, and their
+        results are merged.
+
+        Args:
+            query (str): query text
+            k (int): number of chunks to retrieve
+            filter (Optional[Dict], optional): metadata filter in a format compatible with Chroma. Defaults to None.
+
+        Returns:
+            List[Tuple[Document, float]]: chunks and their distance to the query (lower is more similar).
+        """
+        if not self.partitioned:
+            results = self.db.similarity_search_with_score(
+                query, k=k, filter=self._translate_airline_filter(filter=filter)
             )
-            if uploaded_ids:
-                message = f"{len(uploaded_ids)}/{len(new_chunks)} chunks have been uploaded successfully"
-                logger.info(message)
-            else:
-                raise Exception(
-                    "The documents could not be indexed in the vector database."
+            return self._expand_results_metadata(results=results)
+
+        airlines, filter = self._split_airline_filter(filter=filter)
+        shards = [
+            shard
+            for airline, shard in self._get_shards().items()
+            if airlines is None or airline in airlines
+        ]
+        logger.debug(f"Searching {len(shards)} shards of the vector database.")
+        if not shards:
+            return []
+
+        # Embed the query only once for all the shards
+        query_embedding = self.embeddings.get_embedding_function().embed_query(query)
+        shard_results = _shard_search_executor.map(
+            propagate_profiling(
+                lambda shard: shard.similarity_search_by_vector_with_relevance_scores(
+                    query_embedding, k=k, filter=filter
                 )
+            ),
+            shards,
+        )
+
+        # Merge the top-k of all shards
+        results = [result for results in shard_results for result in results]
+        results = sorted(results, key=lambda result: result[1])[:k]
+        return self._expand_results_metadata(results=results)
+
+    def similarity_search_with_embeddings(
+        self, query: str, k: int, filter: Optional[Dict] = None
+    ) -> Tuple[List[float], List[Tuple[Document, float, List[float]]]]:
+        """Searches the k chunks most similar to a query, like similarity_search_with_score, but also returns
+        the embeddings of the query and of the chunks (e.g., to post-process the results without
+        recomputing them).
+
+        Args:
+            query (str): query text
+            k (int): number of chunks to retrieve
+            filter (Optional[Dict], optional): metadata filter in a format compatible with Chroma. Defaults to None.
+
+        Returns:
+            Tuple[List[float], List[Tuple[Document, float, List[float]]]]: embedding of the query, and chunks with
+                their distance to the query (lower is more similar) and their embedding.
+        """
+        if self.partitioned:
+            airlines, filter = self._split_airline_filter(filter=filter)
+            collections = [
+                shard
+                for airline, shard in self._get_shards().items()
+                if airlines is None or airline in airlines
+            ]
         else:
-            message = "There are no new chunks to add to the vector database."
-            logger.info(message)
+            filter = self._translate_airline_filter(filter=filter)
+            collections = [self.db]
+
+        query_embedding = self.embeddings.get_embedding_function().embed_query(query)
+        collection_results = _shard_search_executor.map(
+            propagate_profiling(
+                lambda collection: collection._collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=k,
+                    where=filter or None,
+                    include=["documents", "metadatas", "distances", "embeddings"],
+                )
+            ),
+            collections,
+        )
 
-        return message
+        # Merge the top-k of all collections
+        results = [
+            (
+                Document(
+                    page_content=content,
+                    metadata=self._expand_metadata(metadata=metadata),
+                ),
+                distance,
+                list(embedding),
+            )
+            for items in collection_results
+            for content, metadata, distance, embedding in zip(
+                items["documents"][0],
+                items["metadatas"][0],
+                items["distances"][0],
+                items["embeddings"][0],
+            )
+        ]
+        return query_embedding, sorted(results, key=lambda result: result[1])[:k]
+
+    def list_airlines(self) -> List[str]:
+        """Returns the list of airlines (different "parent_folder" field in metadata) available in the DB.
+
+        Returns:
+            List[str]: list of airlines
+        """
+        if self.partitioned:
+            return sorted(self._get_shards().keys())
+
+        airlines = set(self.documents.list_airlines())
+
+        # Chunks with the legacy metadata format (not migrated yet) must be scanned
+        if self._has_legacy_metadata(collection=self.db):
+            metadata_list = self.db.get(include=["metadatas"]).get("metadatas")
+            airlines.update(
+                [
+                    metadata.get("parent_folder", "")
+                    for metadata in metadata_list
+                    if "doc_id" not in metadata
+                ]
+            )
+
+        return sorted(airlines)
+
+    def migrate_metadata(self, batch_size: int = 500) -> int:
+        """Converts the chunks stored with the legacy metadata format (full source path, airline and extension
+        in every chunk) to the compact format. Embeddings are kept, so they are not recomputed.
+
+        Returns:
+            int: number of chunks migrated.
+        """
+        self._check_writable()
+        n_migrated = 0
+        for collection in self._get_collections():
+            if not self._has_legacy_metadata(collection=collection):
+                continue
+            # IDs are read first, since re-added chunks would shift the offsets of a paginated read
+            ids = collection.get(include=[])["ids"]
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                items = collection._collection.get(
+                    ids=ids[start:end],
+                    include=["embeddings", "documents", "metadatas"],
+                )
+                legacy_items = [
+                    (id, embedding, content, metadata)
+                    for id, embedding, content, metadata in zip(
+                        items["ids"],
+                        items["embeddings"],
+                        items["documents"],
+                        items["metadatas"],
+                    )
+                    if "doc_id" not in metadata
+                ]
+                if not legacy_items:
+                    continue
+                legacy_ids = [item[0] for item in legacy_items]
+                # Chroma merges metadata on update, so legacy fields are removed by re-adding the chunks
+                collection._collection.delete(ids=legacy_ids)
+                collection._collection.add(
+                    ids=legacy_ids,
+                    embeddings=[item[1] for item in legacy_items],
+                    documents=[item[2] for item in legacy_items],
+                    metadatas=[
+                        self._compact_metadata(metadata=item[3])
+                        for item in legacy_items
+                    ],
+                )
+                self._mark_modified()
+                chunk_cache.invalidate(ids=legacy_ids)
+                n_migrated += len(legacy_ids)
+                logger.info(f"{n_migrated} chunks migrated to compact metadata.")
+        return n_migrated
 
     def list_indexed_elements(self) -> List[str]:
         """Returns the list of IDs of the elements indexed in the Vector DB.
@@ -83,14 +430,144 @@ class VectorDB:
         Returns:
             List[str]: list of IDs
         """
-        # Retrieve List of chunk IDs
-        existing_items = self.db.get(include=[])  # IDs are always included by default
+        existing_ids = set()
+        for collection in self._get_collections():
+            # Retrieve List of chunk IDs
+            existing_items = collection.get(
+                include=[]
+            )  # IDs are always included by default
 
-        # Convert into a set to avoid duplicates
-        existing_ids = set(existing_items["ids"])
+            # Convert into a set to avoid duplicates
+            existing_ids.update(existing_items["ids"])
 
         return existing_ids
 
+    def count(self) -> int:
+        """Returns the number of elements indexed in the Vector DB."""
+        return sum(
+            collection._collection.count() for collection in self._get_collections()
+        )
+
+    def iter_items(self, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Iterates over all the elements of the Vector DB, including their embeddings, in batches.
+
+        Args:
+            batch_size (int, optional): number of elements per batch. Defaults to 1000.
+
+        Yields:
+            List[Dict]: batch of elements, as dictionaries with fields "id", "page_content", "metadata" and "embedding".
+        """
+        for collection in self._get_collections():
+            offset = 0
+            while True:
+                items = collection._collection.get(
+                    include=["embeddings", "documents", "metadatas"],
+                    limit=batch_size,
+                    offset=offset,
+                )
+                if not items["ids"]:
+                    break
+                yield [
+                    {
+                        "id": id,
+                        "page_content": content,
+                        "metadata": self._expand_metadata(metadata=metadata),
+                        "embedding": [float(value) for value in embedding],
+                    }
+                    for id, content, metadata, embedding in zip(
+                        items["ids"],
+                        items["documents"],
+                        items["metadatas"],
+                        items["embeddings"],
+                    )
+                ]
+                offset += len(items["ids"])
+
+    def iter_chunks(
+        self, filter: Optional[Dict] = None, batch_size: int = 1000
+    ) -> Iterator[List[Document]]:
+        """Iterates over the chunks of the Vector DB that match a metadata filter (without their embeddings),
+        in batches.
+
+        Args:
+            filter (Optional[Dict], optional): metadata filter in a format compatible with Chroma. If the DB is
+                partitioned by airline, the airline condition selects the collections. Defaults to None.
+            batch_size (int, optional): number of chunks per batch. Defaults to 1000.
+
+        Yields:
+            List[Document]: batch of chunks, with their id in the metadata field "id".
+        """
+        if self.partitioned:
+            airlines, filter = self._split_airline_filter(filter=filter)
+            collections = [
+                shard
+                for airline, shard in self._get_shards().items()
+                if airlines is None or airline in airlines
+            ]
+        else:
+            filter = self._translate_airline_filter(filter=filter)
+            collections = [self.db]
+
+        for collection in collections:
+            offset = 0
+            while True:
+                items = collection._collection.get(
+                    where=filter or None,
+                    include=["documents", "metadatas"],
+                    limit=batch_size,
+                    offset=offset,
+                )
+                if not items["ids"]:
+                    break
+                yield [
+                    Document(
+                        page_content=content,
+                        metadata={**self._expand_metadata(metadata=metadata), "id": id},
+                    )
+                    for id, content, metadata in zip(
+                        items["ids"], items["documents"], items["metadatas"]
+                    )
+                ]
+                offset += len(items["ids"])
+
+    def add_embedded_items(self, items: List[Dict]) -> int:
+        """Adds (or replaces) elements with precomputed embeddings, without calling the embedding model.
+
+        Args:
+            items (List[Dict]): elements, as dictionaries with fields "id", "page_content", "metadata" and "embedding".
+
+        Returns:
+            int: number of elements added.
+        """
+        self._check_writable()
+        items_by_collection = {}
+        for item in items:
+            collection = (
+                self._get_shard(
+                    airline=item["metadata"].get("parent_folder", ""), create=True
+                )
+                if self.partitioned
+                else self.db
+            )
+            items_by_collection.setdefault(
+                collection._collection.name, (collection, [])
+            )[1].append(item)
+
+        for collection, collection_items in items_by_collection.values():
+            collection._collection.upsert(
+                ids=[item["id"] for item in collection_items],
+                embeddings=[item["embedding"] for item in collection_items],
+                documents=[item["page_content"] for item in collection_items],
+                metadatas=[
+                    self._compact_metadata(metadata=item["metadata"])
+                    for item in collection_items
+                ],
+            )
+            self._mark_modified()
+        chunk_cache.invalidate(ids=[item["id"] for item in items])
+
+        return len(items)
+
     def get_by_id(self, id: str) -> Optional[Dict]:
         """Retrieves an element from the vector DB, given its ID
 
@@ -98,21 +575,48 @@ class VectorDB:
             id (str): id of the chunk to retrieve
 
         Returns:
-            Optional[Dict]: dictionary containing "content" and "metadata" fields.
+            Optional[Dict]: dictionary containing "page_content" and "metadata" fields, or None if it does not exist.
         """
-        item = self.db.get(ids=id, include=["metadatas", "documents"])
-        if item:
-            content = item.get("documents", [])[0]
-            metadata = item.get("metadatas", [])[0]
-            return {"page_content": content, "metadata": metadata}
-        else:
-            return None
+        return self.get_by_ids(ids=[id]).get(id)
+
+    def get_by_ids(self, ids: List[str]) -> Dict[str, Dict]:
+        """Retrieves multiple elements from the vector DB in a single lookup, given their IDs
+
+        Args:
+            ids (List[str]): ids of the chunks to retrieve
+
+        Returns:
+            Dict[str, Dict]: dictionaries containing "page_content" and "metadata" fields, by ID.
+                IDs that do not exist in the DB are not included.
+        """
+        chunks = {}
+        for collection, collection_ids in self._group_ids_by_collection(ids=ids):
+            items = collection.get(
+                ids=collection_ids, include=["metadatas", "documents"]
+            )
+            for id, content, metadata in zip(
+                items.get("ids", []),
+                items.get("documents", []),
+                items.get("metadatas", []),
+            ):
+                chunks[id] = {
+                    "page_content": content,
+                    "metadata": self._expand_metadata(metadata=metadata),
+                }
+        return chunks
 
     def clear_database(self):
         """Deletes the Vector DB."""
+        self._check_writable()
         logger.info(f"Deleting vector database: '{self.persist_dir}'")
         if os.path.exists(self.persist_dir):
             shutil.rmtree(self.persist_dir)
+            self._mark_modified()
+        # The open client keeps references to the deleted files: the next instances open a new one
+        _release_chroma_system(persist_dir=self.persist_dir)
+        self._shards = None
+        self.documents.reload()
+        chunk_cache.clear()
         logger.info("The vector database has been deleted.")
 
     def delete_by_id(self, ids: Union[str, List[str]]):
@@ -121,11 +625,28 @@ class VectorDB:
         Args:
             ids (str | List[str]): ID(s) of the element(s) to be deleted.
         """
+        self._check_writable()
         if not isinstance(ids, List):
             ids = [ids]
-        self.db.delete(ids=ids)
+        for collection, collection_ids in self._group_ids_by_collection(ids=ids):
+            collection.delete(ids=collection_ids)
+            self._mark_modified()
+        chunk_cache.invalidate(ids=ids)
         logger.info(f"{len(ids)} items have been deleted from the vector database.")
 
+    def _mark_modified(self):
+        """Records that the DB has been modified, so that its index version is updated
+        at the end of the write operation (see commit_index_changes)."""
+        with _open_index_versions_lock:
+            _modified_dirs.add(self.persist_dir)
+            _forget_legacy_metadata(persist_dir=self.persist_dir)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise Exception(
+                "The vector database is open in read-only mode. Write operations must be sent to the index writer."
+            )
+
     def _assign_chunk_ids(self, chunks: List[Document]) -> List[Document]:
         """Assign id to each chunk, in the metadata field "id".
 
@@ -140,19 +661,304 @@ class VectorDB:
             List[Document]: list of chunks with updated "id" field in their metadata.
         """
         for chunk in chunks:
-            # Retrieve metadata that will be use to compose the chunk id
-            parent_folder = chunk.metadata.get("parent_folder", "")
-            source = chunk.metadata.get("source", "")
-            order = chunk.metadata.get("order", "")
+            # Add id to chunk's metadata
+            chunk.metadata["id"] = get_chunk_id(metadata=chunk.metadata)
 
-            # Get name of the file the chunk belongs to
-            filename = os.path.basename(source)
+        return chunks
 
-            # Compose the chunk id
-            # e.g.: "AmericanAirlines/Policy.md:5"
-            chunk_id = f"{parent_folder}/{filename}:{order}"
+    def _compact_metadata(self, metadata: Dict) -> Dict:
+        """Converts the metadata of a chunk to the compact format: document fields are replaced by the
+        doc_id of the document in the document table, and the chunk id is removed (it is the Chroma ID).
+        """
+        if "source" not in metadata:
+            return metadata
+        doc_id = self.documents.get_or_create(
+            source=metadata.get("source", ""),
+            parent_folder=metadata.get("parent_folder", ""),
+            extension=metadata.get("extension", ""),
+        )
+        compact_metadata = {
+            key: value
+            for key, value in metadata.items()
+            if key not in DOCUMENT_FIELDS and key != "id"
+        }
+        compact_metadata["doc_id"] = doc_id
+        return compact_metadata
+
+    def _expand_metadata(self, metadata: Optional[Dict]) -> Dict:
+        """Converts compact chunk metadata back to the full format, using the document table.
+        Metadata in the legacy format is returned unchanged."""
+        metadata = dict(metadata or {})
+        if "doc_id" not in metadata:
+            return metadata
+        document = self.documents.get(metadata.pop("doc_id")) or {}
+        for field in DOCUMENT_FIELDS:
+            metadata[field] = document.get(field, "")
+        metadata["id"] = get_chunk_id(metadata=metadata)
+        return metadata
+
+    def _expand_results_metadata(
+        self, results: List[Tuple[Document, float]]
+    ) -> List[Tuple[Document, float]]:
+        """Expands the metadata of the chunks returned by a similarity search."""
+        for doc, _score in results:
+            doc.metadata = self._expand_metadata(metadata=doc.metadata)
+        return results
+
+    def _translate_airline_filter(self, filter: Optional[Dict]) -> Optional[Dict]:
+        """Translates an airline filter ({"parent_folder": {"$in": [...]}}) into a filter on the doc_ids
+        of the documents of those airlines. Chunks with legacy metadata are also matched by airline.
+        """
+        airlines, remaining_filter = self._split_airline_filter(filter=filter)
+        if airlines is None:
+            return filter
+
+        conditions = [{"parent_folder": {"$in": airlines}}]
+        doc_ids = self.documents.get_doc_ids(airlines=airlines)
+        if doc_ids:
+            conditions.append({"doc_id": {"$in": doc_ids}})
+        airline_filter = conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+        if remaining_filter:
+            return {"$and": [airline_filter, remaining_filter]}
+        return airline_filter
+
+    def _has_legacy_metadata(self, collection: Chroma) -> bool:
+        """Checks whether a collection has chunks with the legacy metadata format (without "doc_id").
+        The result is cached until the index changes."""
+        key = (self.persist_dir, collection._collection.name)
+        with _open_index_versions_lock:
+            has_legacy_metadata = _legacy_metadata_collections.get(key)
+        if has_legacy_metadata is None:
+            # Negated conditions also match missing fields in Chroma, so the compact chunks are counted instead
+            compact_items = collection.get(where={"doc_id": {"$gte": 0}}, include=[])
+            has_legacy_metadata = (
+                len(compact_items["ids"]) < collection._collection.count()
+            )
+            with _open_index_versions_lock:
+                _legacy_metadata_collections[key] = has_legacy_metadata
+        return has_legacy_metadata
+
+    def _get_collections(self) -> List[Chroma]:
+        """Returns all the collections of the DB: the shards if it is partitioned, or the single default collection."""
+        if self.partitioned:
+            return list(self._get_shards().values())
+        return [self.db]
+
+    def _get_shards(self) -> Dict[str, Chroma]:
+        """Returns the existing per-airline collections (shards), by airline."""
+        if self._shards is None:
+            self._shards = {}
+            client = self.db._client
+            for collection in client.list_collections():
+                # Depending on the chromadb version, collections are listed by name or as objects
+                name = collection if isinstance(collection, str) else collection.name
+                if not name.startswith(SHARD_PREFIX):
+                    continue
+                metadata = client.get_collection(name).metadata or {}
+                if "parent_folder" in metadata:
+                    self._shards[metadata["parent_folder"]] = self._open_shard(
+                        airline=metadata["parent_folder"]
+                    )
+        return self._shards
+
+    def _get_shard(self, airline: str, create: bool = False) -> Optional[Chroma]:
+        """Returns the collection (shard) of an airline. It is created if it does not exist and create=True."""
+        shards = self._get_shards()
+        if airline not in shards and create:
+            self._check_writable()
+            logger.info(f"Creating collection for airline '{airline}'")
+            shards[airline] = self._open_shard(airline=airline)
+        return shards.get(airline)
+
+    def _open_shard(self, airline: str) -> Chroma:
+        """Opens (or creates) the collection (shard) of an airline."""
+        # Collection names only accept some characters: add a hash of the airline to avoid collisions
+        slug = re.sub(r"[^a-zA-Z0-9_-]", "_", airline)[:40]
+        digest = hashlib.sha1(airline.encode("utf-8")).hexdigest()[:8]
+        return Chroma(
+            client=self.db._client,
+            collection_name=f"{SHARD_PREFIX}{slug}_{digest}",
+            embedding_function=self.embeddings.get_embedding_function(),
+            collection_metadata={"parent_folder": airline},
+        )
 
-            # Add id to chunk's metadata
-            chunk.metadata["id"] = chunk_id
+    def _group_ids_by_collection(
+        self, ids: List[str]
+    ) -> List[Tuple[Chroma, List[str]]]:
+        """Groups chunk IDs by the collection they belong to.
+        In partitioned DBs, the airline is taken from the chunk ID ("parent_folder/filename:order").
+        IDs of airlines without a collection are ignored.
+        """
+        if not self.partitioned:
+            return [(self.db, ids)] if ids else []
+
+        ids_by_airline = {}
+        for id in ids:
+            ids_by_airline.setdefault(id.split("/", 1)[0], []).append(id)
+        return [
+            (self._get_shard(airline=airline), airline_ids)
+            for airline, airline_ids in ids_by_airline.items()
+            if self._get_shard(airline=airline) is not None
+        ]
 
-        return chunks
+    @staticmethod
+    def _split_airline_filter(
+        filter: Optional[Dict],
+    ) -> Tuple[Optional[List[str]], Optional[Dict]]:
+        """Splits a metadata filter into the list of airlines it selects ("parent_folder" condition)
+        and the rest of the filter.
+
+        Returns:
+            Tuple[Optional[List[str]], Optional[Dict]]: airlines (None if not filtered by airline), and remaining filter.
+        """
+        if not filter or "parent_folder" not in filter:
+            return None, filter or None
+
+        condition = filter["parent_folder"]
+        if isinstance(condition, dict):
+            airlines = condition.get("$in") or [condition.get("$eq")]
+        else:
+            airlines = [condition]
+        remaining_filter = {
+            key: value for key, value in filter.items() if key != "parent_folder"
+        }
+        return airlines, remaining_filter or None
+
+
+def get_index_version(persist_dir: str) -> Optional[str]:
+    """Returns the current version of the index of a vector DB directory, or None if it has never been written."""
+    try:
+        with open(os.path.join(persist_dir, INDEX_VERSION_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def refresh_if_index_changed(persist_dir: str):
+    """Reopens a vector DB directory if its index version has changed since it was opened by this process
+    (i.e., another process has written to it). Cached chunks and documents are discarded.
+    It must be called before reading anything cached from the directory (e.g., the chunk cache).
+    """
+    _stop_retired_chroma_systems()
+    version = get_index_version(persist_dir=persist_dir)
+    with _open_index_versions_lock:
+        if (
+            persist_dir in _open_index_versions
+            and _open_index_versions[persist_dir] != version
+        ):
+            logger.info(f"The index has changed (version {version}). Reopening it.")
+            _release_chroma_system(persist_dir=persist_dir)
+            get_document_table(persist_dir=persist_dir).reload()
+            chunk_cache.clear()
+            _forget_legacy_metadata(persist_dir=persist_dir)
+        _open_index_versions[persist_dir] = version
+
+
+def commit_index_changes(persist_dir: str) -> Optional[str]:
+    """Updates the index version of a vector DB directory if this process has modified it since the last
+    update, so that the other processes reopen it. Nothing is done if it has not been modified.
+
+    Returns:
+        Optional[str]: the new index version, or None if the directory has not been modified.
+    """
+    with _open_index_versions_lock:
+        if persist_dir not in _modified_dirs:
+            return None
+    return mark_index_changed(persist_dir=persist_dir)
+
+
+def mark_index_changed(persist_dir: str) -> str:
+    """Writes a new index version in a vector DB directory, so that the other processes using it reopen it.
+
+    Returns:
+        str: the new index version.
+    """
+    version = uuid.uuid4().hex
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, INDEX_VERSION_FILE)
+    # Written to a temporary file first, so that readers never see a partial version
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    with _open_index_versions_lock:
+        _open_index_versions[persist_dir] = version
+        _modified_dirs.discard(persist_dir)
+    logger.info(f"Index version updated: {version}")
+    return version
+
+
+def _forget_legacy_metadata(persist_dir: str):
+    """Discards the cached legacy metadata checks of a vector DB directory. The lock must be held."""
+    for key in [key for key in _legacy_metadata_collections if key[0] == persist_dir]:
+        del _legacy_metadata_collections[key]
+
+
+def _release_chroma_system(persist_dir: str):
+    """Forgets the Chroma client (system) shared by the instances that use a directory, so that the next
+    instances open the directory again and read its current content. Instances in use keep the old client,
+    which is stopped after a grace period.
+
+    Chroma has no public API for this: the cache of clients is a private attribute of SharedSystemClient
+    (chromadb 0.5, as pinned in pyproject.toml). If it is missing, the directory is not reopened.
+    """
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if not isinstance(systems, dict):
+        logger.warning(
+            "The Chroma client cannot be reopened with this version of chromadb. "
+            "Restart the server to read the changes of the vector database."
+        )
+        return
+    system = systems.pop(persist_dir, None)
+    if system is not None:
+        with _retired_chroma_systems_lock:
+            _retired_chroma_systems.append((time.monotonic(), system))
+
+
+def _stop_retired_chroma_systems():
+    """Stops the replaced Chroma clients whose grace period has expired."""
+    if not _retired_chroma_systems:
+        return
+    now = time.monotonic()
+    with _retired_chroma_systems_lock:
+        expired = [
+            system
+            for retired_at, system in _retired_chroma_systems
+            if now - retired_at >= RETIRED_CHROMA_SYSTEM_GRACE_PERIOD
+        ]
+        _retired_chroma_systems[:] = [
+            (retired_at, system)
+            for retired_at, system in _retired_chroma_systems
+            if now - retired_at < RETIRED_CHROMA_SYSTEM_GRACE_PERIOD
+        ]
+    for system in expired:
+        try:
+            system.stop()
+        except Exception as e:
+            logger.warning(f"Could not stop a replaced Chroma client: {e}")
+
+
+def get_chunk_id(metadata: Dict) -> str:
+    """Compose the id of a chunk from its metadata.
+
+    The format of the chunk id is: "parent_folder/filename:order"
+
+    e.g.: "AmericanAirlines/Policy.md:5"
+
+    Args:
+        metadata (Dict): metadata of the chunk. Fields "parent_folder", "source" and "order" are used.
+
+    Returns:
+        str: the chunk id
+    """
+    # Retrieve metadata that will be use to compose the chunk id
+    parent_folder = metadata.get("parent_folder", "")
+    source = metadata.get("source", "")
+    order = metadata.get("order", "")
+
+    # Get name of the file the chunk belongs to
+    filename = os.path.basename(source)
+
+    # Compose the chunk id
+    return f"{parent_folder}/{filename}:{order}"
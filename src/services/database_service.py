@@ -1,9 +1,14 @@
+import itertools
 import logging
 import os
-from typing import List, Union
+from typing import Callable, Iterable, Iterator, List, Optional, Union
 
+from langchain_core.documents import Document
+
+from src.modules.rag.deduplicator import Deduplicator
 from src.modules.rag.document_reader import DocumentReader
 from src.modules.rag.document_splitter import DocumentSplitter
+from src.modules.rag.snapshot import export_snapshot, import_snapshot
 from src.modules.rag.vector_db import VectorDB
 
 logger = logging.getLogger(__name__)
@@ -11,10 +16,14 @@ logger = logging.getLogger(__name__)
 
 def load_documents(data_path: Union[List, str]) -> str:
     """Function to load a document, directory or list of documents into the vector database.
-    The loading process is divided in three steps:
+    The loading process is divided in four steps:
     1. Reading the files
     2. Splitting the documents into chunks
-    3. Indexing the chunks in the vector database
+    3. Removing near-duplicate chunks (optional)
+    4. Indexing the chunks in the vector database
+
+    Files are read and split lazily, and chunks are indexed in batches of INGEST_BATCH_SIZE,
+    so that memory usage does not grow with the size of the uploaded documents.
 
     Args:
         data_path (Union[List, str]): path to file or directory to load.
@@ -26,24 +35,158 @@ def load_documents(data_path: Union[List, str]) -> str:
     """
     try:
 
-        # 1. Read documents
+        # 1. Read documents (lazily)
         logger.info("Reading documents.")
         document_reader = DocumentReader(data_path)
-        documents = document_reader.read_documents()
-        logger.info(f"{len(documents)} documents have been read.")
-
-        # 2. Split documents into chunks
-        logger.info("Splitting documents into chunks.")
-        document_splitter = DocumentSplitter(documents=documents)
-        chunks = document_splitter.split_documents()
+        documents = document_reader.lazy_read_documents()
 
-        # 3. Index chunks in vector database
-        logger.info("Indexing documents in vector database.")
         chroma_path = os.getenv("CHROMA_PATH")
         vector_db = VectorDB(persist_dir=chroma_path)
-        message = vector_db.index_documents(documents=chunks)
+
+        # 2. Split documents into chunks (lazily)
+        logger.info("Splitting documents into chunks.")
+        document_splitter = DocumentSplitter(
+            documents=documents, length_function=get_length_function(vector_db)
+        )
+        chunks = document_splitter.lazy_split_documents()
+
+        deduplicator = None
+        if os.getenv("DEDUPLICATE_CHUNKS", "False").lower() == "true":
+            # Chunks are also compared with the chunks indexed by previous uploads
+            deduplicator = Deduplicator(
+                threshold=float(os.getenv("DEDUPLICATION_THRESHOLD", 0.9)),
+                load_indexed_chunks=lambda airline: (
+                    chunk
+                    for batch in vector_db.iter_chunks(
+                        filter={"parent_folder": airline}
+                    )
+                    for chunk in batch
+                ),
+            )
+
+        n_chunks, n_new_chunks, n_uploaded_chunks = 0, 0, 0
+        batch_size = int(os.getenv("INGEST_BATCH_SIZE", 256))
+        for batch in _batched(chunks, batch_size=batch_size):
+            n_chunks += len(batch)
+
+            # 3. Remove near-duplicate chunks
+            if deduplicator:
+                batch = [
+                    chunk
+                    for doc in deduplicator.deduplicate(documents=[batch])
+                    for chunk in doc
+                ]
+
+            # 4. Index chunks in vector database
+            logger.info(f"Indexing batch of {len(batch)} chunks in vector database.")
+            n_new, n_uploaded = vector_db.index_chunks(chunks=batch)
+            n_new_chunks += n_new
+            n_uploaded_chunks += n_uploaded
+
+        logger.info(f"{n_chunks} chunks have been processed.")
+
+        if n_new_chunks:
+            message = f"{n_uploaded_chunks}/{n_new_chunks} chunks have been uploaded successfully"
+        else:
+            message = "There are no new chunks to add to the vector database."
+        logger.info(message)
+
+        if deduplicator:
+            # Duplicates of chunks indexed in previous batches
+            late_aliases = deduplicator.pop_late_aliases()
+            if late_aliases:
+                vector_db.update_metadata(metadatas=late_aliases)
+            logger.info(deduplicator.get_report())
+            message = f"{message.rstrip('.')}. {deduplicator.get_report()}"
 
         return message
 
     except Exception as e:
         return f"Error. Exception occurred during upload process: '{e}'"
+
+
+def create_snapshot(snapshot_path: str) -> str:
+    """Function to export the content of the vector database (vectors, chunks, metadata) to a snapshot bundle.
+
+    Args:
+        snapshot_path (str): path of the snapshot bundle to create.
+
+    Returns:
+        str: message indicating success.
+    """
+    chroma_path = os.getenv("CHROMA_PATH")
+    vector_db = VectorDB(persist_dir=chroma_path)
+    manifest = export_snapshot(vector_db=vector_db, snapshot_path=snapshot_path)
+    return f"{manifest['n_items']} chunks have been exported to '{snapshot_path}'"
+
+
+def load_snapshot(
+    snapshot_path: str, force: bool = False, only_if_empty: bool = False
+) -> str:
+    """Function to import a snapshot bundle into the vector database, without recomputing any embedding.
+
+    Args:
+        snapshot_path (str): path of the snapshot bundle.
+        force (bool, optional): import the snapshot even if it was created with a different embedding model.
+            Defaults to False.
+        only_if_empty (bool, optional): only import the snapshot if the vector database is empty
+            (e.g., when starting a new server). Defaults to False.
+
+    Returns:
+        str: message indicating success.
+    """
+    chroma_path = os.getenv("CHROMA_PATH")
+    vector_db = VectorDB(persist_dir=chroma_path)
+    if only_if_empty and vector_db.count() > 0:
+        message = (
+            "The vector database is not empty. The snapshot has not been imported."
+        )
+        logger.info(message)
+        return message
+    manifest = import_snapshot(
+        vector_db=vector_db, snapshot_path=snapshot_path, force=force
+    )
+    return f"{manifest['n_items']} chunks have been imported from '{snapshot_path}'"
+
+
+def migrate_metadata() -> str:
+    """Function to convert the chunks indexed with the legacy metadata format (full source path, airline
+    and extension in every chunk) to the compact format, keeping their embeddings.
+    Creating a snapshot before the migration is recommended.
+
+    Returns:
+        str: message indicating success.
+    """
+    chroma_path = os.getenv("CHROMA_PATH")
+    vector_db = VectorDB(persist_dir=chroma_path)
+    n_migrated = vector_db.migrate_metadata()
+    if n_migrated == 0:
+        return "There are no chunks with the legacy metadata format."
+    return f"{n_migrated} chunks have been migrated to the compact metadata format"
+
+
+def clear_database() -> str:
+    """Function to delete the vector database.
+
+    Returns:
+        str: message indicating success.
+    """
+    chroma_path = os.getenv("CHROMA_PATH")
+    vector_db = VectorDB(persist_dir=chroma_path)
+    vector_db.clear_database()
+    return "The vector database has been deleted"
+
+
+def get_length_function(vector_db: VectorDB) -> Optional[Callable[[str], int]]:
+    """Returns the function used to measure the size of the chunks: the token counter of the embedding model
+    if CHUNK_SIZE_UNIT is "tokens", or None (number of characters) otherwise."""
+    if os.getenv("CHUNK_SIZE_UNIT", "characters").lower() == "tokens":
+        return vector_db.embeddings.get_token_counter()
+    return None
+
+
+def _batched(chunks: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    """Groups an iterable of chunks into lists of at most batch_size elements."""
+    iterator = iter(chunks)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
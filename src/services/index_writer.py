@@ -0,0 +1,151 @@
+"""
+Index writer: single process that runs the write operations on the vector database.
+
+When the server runs several workers, they all open the vector database in read-only mode, and send the
+operations that modify it (upload documents, import a snapshot, clear it...) to the index writer, through a
+local socket. The writer runs them one at a time, and then updates the index version if they have modified the
+index, so that the workers reopen it and see the changes without being restarted.
+
+If INDEX_WRITER_ADDRESS is not set (single process server), the operations are run in the current process.
+"""
+
+import logging
+import os
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Optional, Tuple, Union
+
+from src.modules.rag.vector_db import VectorDB, commit_index_changes
+from src.services.database_service import (
+    clear_database,
+    load_documents,
+    load_snapshot,
+    migrate_metadata,
+)
+
+logger = logging.getLogger(__name__)
+
+# Operations that modify the vector database
+WRITE_OPERATIONS = {
+    "load_documents": load_documents,
+    "load_snapshot": load_snapshot,
+    "clear_database": clear_database,
+    "migrate_metadata": migrate_metadata,
+}
+
+
+def submit(operation: str, **kwargs) -> str:
+    """Runs a write operation on the vector database: in the index writer if INDEX_WRITER_ADDRESS is set,
+    or in the current process otherwise.
+
+    Args:
+        operation (str): name of the operation (one of WRITE_OPERATIONS).
+        **kwargs: arguments of the operation.
+
+    Returns:
+        str: message returned by the operation.
+
+    Raises:
+        Exception: if the operation failed in the index writer.
+    """
+    address = _get_address()
+    if address is None:
+        return run_operation(operation, **kwargs)
+
+    logger.info(f"Sending operation '{operation}' to the index writer.")
+    with _connect(address=address) as connection:
+        connection.send((operation, kwargs))
+        succeeded, result = connection.recv()
+    if not succeeded:
+        raise Exception(f"The index writer could not run '{operation}': {result}")
+    return result
+
+
+def run_operation(operation: str, **kwargs) -> str:
+    """Runs a write operation on the vector database in the current process, and updates the index version
+    if the operation has modified the index (even partially, if it then failed).
+
+    Returns:
+        str: message returned by the operation.
+    """
+    if operation not in WRITE_OPERATIONS:
+        raise ValueError(
+            f"Unsupported operation: '{operation}'. Must be one of: {list(WRITE_OPERATIONS)}."
+        )
+    try:
+        return WRITE_OPERATIONS[operation](**kwargs)
+    finally:
+        commit_index_changes(persist_dir=os.getenv("CHROMA_PATH"))
+
+
+def run_index_writer():
+    """Runs the index writer: waits for operations sent by the server workers, and runs them one at a time.
+    It listens on INDEX_WRITER_ADDRESS (path of a Unix socket, or "host:port")."""
+    address = _get_address()
+    if address is None:
+        raise ValueError("INDEX_WRITER_ADDRESS must be set to run the index writer.")
+    if not isinstance(address, str) and _get_authkey() is None:
+        # Operations are exchanged as pickles, which must only be accepted from authenticated clients
+        raise ValueError(
+            "INDEX_WRITER_AUTHKEY must be set when the index writer listens on a TCP port."
+        )
+
+    # The writer is the only process allowed to modify the vector database
+    os.environ["INDEX_READ_ONLY"] = "false"
+    # Create the vector database if it does not exist, so that the workers do not create it
+    VectorDB(persist_dir=os.getenv("CHROMA_PATH"))
+
+    if isinstance(address, str) and os.path.exists(address):
+        # Socket left by a previous writer
+        os.remove(address)
+
+    with Listener(address, authkey=_get_authkey()) as listener:
+        logger.info(f"Index writer listening on {address}")
+        while True:
+            try:
+                with listener.accept() as connection:
+                    operation, kwargs = connection.recv()
+                    logger.info(f"Running operation '{operation}'.")
+                    connection.send(_run_received_operation(operation, kwargs))
+            except (AuthenticationError, EOFError, OSError) as e:
+                # Connection lost or not authenticated. The writer keeps serving the other workers
+                logger.warning(f"Index writer connection error: {e}")
+
+
+def _run_received_operation(operation: str, kwargs: dict) -> Tuple[bool, str]:
+    """Runs an operation received by the writer. Returns whether it succeeded, and its message or error."""
+    try:
+        return True, run_operation(operation, **kwargs)
+    except Exception as e:
+        logger.exception(f"Operation '{operation}' failed.")
+        return False, str(e)
+
+
+def _connect(address: Union[str, Tuple[str, int]]) -> Connection:
+    """Connects to the index writer. It is retried for INDEX_WRITER_CONNECT_TIMEOUT seconds,
+    in case the writer is still starting (or being restarted)."""
+    deadline = time.monotonic() + float(os.getenv("INDEX_WRITER_CONNECT_TIMEOUT", 10))
+    while True:
+        try:
+            return Client(address, authkey=_get_authkey())
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() >= deadline:
+                raise Exception("The index writer is not available.")
+            time.sleep(0.2)
+
+
+def _get_address() -> Optional[Union[str, Tuple[str, int]]]:
+    """Returns the address of the index writer (INDEX_WRITER_ADDRESS), or None if it is not set."""
+    address = os.getenv("INDEX_WRITER_ADDRESS")
+    if not address:
+        return None
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def _get_authkey() -> Optional[bytes]:
+    authkey = os.getenv("INDEX_WRITER_AUTHKEY")
+    return authkey.encode("utf-8") if authkey else None
@@ -1,13 +1,16 @@
 import logging
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from langchain.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI
+from langchain.schema.document import Document
 
-from src.modules.rag.embeddings import CustomEmbeddings
+from src.modules.rag.chunk_cache import chunk_cache
+from src.modules.rag.llm_client import get_llm_client
 from src.modules.rag.prompts import DEFAULT_PROMPT_TEMPLATE
+from src.modules.rag.query_condenser import query_condenser
+from src.modules.rag.retrieval_postprocessor import RetrievalPostProcessor
+from src.modules.rag.vector_db import VectorDB
 
 logger = logging.getLogger(__name__)
 
@@ -19,20 +22,31 @@ def query_rag(query_text: str, memory: List[Optional[Dict]] = []) -> dict:
         query_text (str): query
         memory (List[Optional[Dict]]): chat memory, given as a list of dictionaries (fields "question", "answer"). Optional.
 
+    If the query condensation is enabled (QUERY_CONDENSATION), a follow-up query is first rewritten as a standalone
+    query using the memory. The standalone query is used for retrieval and in the prompt, instead of the memory,
+    so that follow-up queries get the same prompts (and cached answers) as the equivalent single-turn queries.
+    Queries that are not rewritten are answered with the memory, as without condensation.
+
     Returns:
-        dict: dictionary containing the fields "answer" and "sources"
-    """
+        dict: dictionary containing the fields "answer", "sources" and "query" (the standalone query, if it
+            has been rewritten, or the original one)
 
+    Raises:
+        LLMUnavailableError: if the LLM could not generate an answer before the deadline.
+    """
     # Prepare the DB.
-    embeddings = CustomEmbeddings(
-        provider=os.getenv("EMBEDDINGS_PROVIDER"),
-        model_name=os.getenv("EMBEDDINGS_MODEL"),
-    )
     chroma_path = os.getenv("CHROMA_PATH")
-    db = Chroma(
-        persist_directory=chroma_path,
-        embedding_function=embeddings.get_embedding_function(),
-    )
+    db = VectorDB(persist_dir=chroma_path)
+
+    # Rewrite follow-up queries as standalone queries
+    if query_condenser is not None:
+        standalone_query = query_condenser.condense(
+            question=query_text, memory=memory, airlines=db.list_airlines()
+        )
+        # The memory is only dropped if the query no longer depends on it
+        if standalone_query != query_text:
+            query_text = standalone_query
+            memory = []
 
     # Create metadata filter depending on the airline the query refers to
     filter_by_airline = os.getenv("FILTER_BY_AIRLINE", "False").lower() == "true"
@@ -40,11 +54,66 @@ def query_rag(query_text: str, memory: List[Optional[Dict]] = []) -> dict:
     if filter_by_airline:
         metadata_filter = get_airline_filter(db=db, query=query_text)
 
-    # Search relevant documents in the database
-    results = db.similarity_search_with_score(
-        query_text, k=int(os.getenv("TOP_K", 5)), filter=metadata_filter
-    )
+    # Search relevant documents in the database.
+    # If the DB is partitioned by airline, the filter selects the collections to search
+    top_k = int(os.getenv("TOP_K", 5))
+    if os.getenv("RETRIEVAL_POSTPROCESSING", "False").lower() == "true":
+        # Fetch more candidates, and keep the most relevant and diverse ones (adaptive top-k and MMR)
+        query_embedding, candidates = db.similarity_search_with_embeddings(
+            query_text,
+            k=int(os.getenv("RETRIEVAL_FETCH_K", top_k)),
+            filter=metadata_filter,
+        )
+        results = RetrievalPostProcessor.from_env(k=top_k).process(
+            query_embedding=query_embedding, results=candidates
+        )
+    else:
+        results = db.similarity_search_with_score(
+            query_text, k=top_k, filter=metadata_filter
+        )
+
+    # Keep retrieved chunks in cache, so that the sources can be shown to the user without querying the DB again
+    for doc, _score in results:
+        if doc.metadata.get("id"):
+            chunk_cache.put(
+                id=doc.metadata["id"],
+                page_content=doc.page_content,
+                metadata=doc.metadata,
+            )
+
+    # Format the prompt, with the retrieved sources and the chat memory
+    prompt = build_prompt(query_text=query_text, results=results, memory=memory)
+
+    # Get LLM response (with deadline, retries, rate limiting and response cache)
+    llm = get_llm_client(model=os.getenv("OPENAI_MODEL", "gpt-4o"))
+
+    response_text = llm.invoke(prompt)
+
+    # Return answer and sources
+    sources = [doc.metadata.get("id", None) for doc, _score in results]
+    formatted_response = f"Response: {response_text}\nSources: {sources}"
+    print(formatted_response)
+
+    response = {"answer": response_text, "sources": sources, "query": query_text}
+
+    return response
 
+
+def build_prompt(
+    query_text: str,
+    results: List[Tuple[Document, float]],
+    memory: List[Optional[Dict]] = [],
+) -> str:
+    """Composes the prompt sent to the LLM, from the query, the retrieved chunks and the chat memory.
+
+    Args:
+        query_text (str): query
+        results (List[Tuple[Document, float]]): retrieved chunks and their distance to the query.
+        memory (List[Optional[Dict]]): chat memory, given as a list of dictionaries (fields "question", "answer"). Optional.
+
+    Returns:
+        str: the prompt
+    """
     # Compose context from retrieved sources
     context_text = "\n\n---\n\n".join(
         [
@@ -63,28 +132,12 @@ def query_rag(query_text: str, memory: List[Optional[Dict]] = []) -> dict:
 
     # Format the prompt
     prompt_template = ChatPromptTemplate.from_template(DEFAULT_PROMPT_TEMPLATE)
-    prompt = prompt_template.format(
+    return prompt_template.format(
         memory=memory_text, context=context_text, question=query_text
     )
 
-    # Get LLM response
-    llm = ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL", "gpt-4o"),
-    )
-
-    response_text = llm.invoke(prompt).content
 
-    # Return answer and sources
-    sources = [doc.metadata.get("id", None) for doc, _score in results]
-    formatted_response = f"Response: {response_text}\nSources: {sources}"
-    print(formatted_response)
-
-    response = {"answer": response_text, "sources": sources}
-
-    return response
-
-
-def get_airline_filter(db: Chroma, query: str) -> Optional[Dict]:
+def get_airline_filter(db: VectorDB, query: str) -> Optional[Dict]:
     """Analyzes the query and detects whether it refers to specific airline(s) or not.
     If it does, it returns a metadata filter in dictionary format, so that only
     chunks of documents belonging to the specific airline can be retrieved from the db.
@@ -92,14 +145,11 @@ def get_airline_filter(db: Chroma, query: str) -> Optional[Dict]:
     Returns:
         Optional[Dict]: the metadata filter in a format compatible with Chroma
     """
-    
+
     metadata_filter = None
-    
+
     # Get list of available airlines in the db (different "parent_folder" field in metadata)
-    metadata_list = db.get(include=["metadatas"]).get("metadatas")
-    airlines_available = set(
-        [metadata.get("parent_folder", "") for metadata in metadata_list]
-    )
+    airlines_available = db.list_airlines()
 
     # Check if any specific airline is mentioned in the query (
     # TODO: This is a Naive Approach. Improvements: use and LLM, NER or Fuzzy Matching
@@ -116,5 +166,5 @@ def get_airline_filter(db: Chroma, query: str) -> Optional[Dict]:
     # Set up filters for the mentioned airline(s)
     if airlines_mentioned:
         metadata_filter = {"parent_folder": {"$in": airlines_mentioned}}
-        
-    return metadata_filter
\ No newline at end of file
+
+    return metadata_filter
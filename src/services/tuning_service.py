@@ -0,0 +1,151 @@
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Union
+
+from src.modules.rag.document_reader import DocumentReader
+from src.modules.rag.document_splitter import DocumentSplitter
+from src.modules.rag.embeddings import get_token_counter
+from src.modules.rag.vector_db import VectorDB
+from src.services.database_service import _batched, get_length_function
+from src.services.query_service import build_prompt, get_airline_filter
+
+logger = logging.getLogger(__name__)
+
+
+def tune_chunking(
+    data_path: Union[List, str],
+    questions_path: str,
+    chunk_sizes: List[int],
+    chunk_overlaps: List[int],
+) -> List[Dict]:
+    """Function to compare chunking settings. For each combination of chunk size and overlap, the documents
+    are indexed in a temporary vector database, and the labelled questions are asked to it.
+
+    The chunk size is used both for the recursive splitter and as the max size of the markdown chunks.
+    Sizes are measured in tokens or characters, depending on the CHUNK_SIZE_UNIT env variable.
+
+    Args:
+        data_path (Union[List, str]): path to file or directory to load. It also accepts a list of paths.
+        questions_path (str): JSON file with the labelled questions: a list of dictionaries with fields
+            "question" and "sources" (relevant files, as "<airline>/<file name>").
+        chunk_sizes (List[int]): chunk sizes to try.
+        chunk_overlaps (List[int]): chunk overlaps to try.
+
+    Returns:
+        List[Dict]: one dictionary per combination, with the number of chunks, the index size (MB), the ingestion
+            time (seconds), the retrieval hit-rate (fraction of questions for which a relevant file is retrieved)
+            and the average number of tokens of the prompts.
+    """
+    with open(questions_path, "r") as f:
+        questions = json.load(f)
+
+    results = []
+    for chunk_size, chunk_overlap in itertools.product(chunk_sizes, chunk_overlaps):
+        if chunk_overlap >= chunk_size:
+            logger.warning(
+                f"Skipping chunk size {chunk_size} with overlap {chunk_overlap}: the overlap must be smaller."
+            )
+            continue
+        logger.info(f"Evaluating chunk size {chunk_size}, overlap {chunk_overlap}.")
+        with tempfile.TemporaryDirectory() as persist_dir:
+            results.append(
+                _evaluate_chunking(
+                    data_path=data_path,
+                    questions=questions,
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    persist_dir=persist_dir,
+                )
+            )
+    return results
+
+
+def format_tuning_results(results: List[Dict]) -> str:
+    """Formats the results of tune_chunking as a text table."""
+    columns = list(results[0].keys()) if results else []
+    rows = [columns] + [
+        [str(result[column]) for column in columns] for result in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(value.rjust(width) for value, width in zip(row, widths))
+        for row in rows
+    )
+
+
+def _evaluate_chunking(
+    data_path: Union[List, str],
+    questions: List[Dict],
+    chunk_size: int,
+    chunk_overlap: int,
+    persist_dir: str,
+) -> Dict:
+    """Indexes the documents with the given chunking settings and evaluates the retrieval."""
+    vector_db = VectorDB(persist_dir=persist_dir, partitioned=False)
+    # Prompts are measured with the tokenizer of the LLM that receives them, not the one of the embedding model
+    count_tokens = get_token_counter(
+        model=os.getenv("OPENAI_MODEL", "gpt-4o"), fallback_encoding="o200k_base"
+    )
+
+    # Ingestion
+    start_time = time.perf_counter()
+    documents = DocumentReader(data_path).lazy_read_documents()
+    chunks = DocumentSplitter(
+        documents=documents,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        markdown_max_chunk_size=chunk_size,
+        length_function=get_length_function(vector_db),
+    ).lazy_split_documents()
+    n_chunks = 0
+    for batch in _batched(chunks, batch_size=int(os.getenv("INGEST_BATCH_SIZE", 256))):
+        vector_db.index_chunks(chunks=batch)
+        n_chunks += len(batch)
+    ingest_time = time.perf_counter() - start_time
+
+    # Retrieval
+    filter_by_airline = os.getenv("FILTER_BY_AIRLINE", "False").lower() == "true"
+    n_hits, n_prompt_tokens = 0, 0
+    for question in questions:
+        metadata_filter = None
+        if filter_by_airline:
+            metadata_filter = get_airline_filter(
+                db=vector_db, query=question["question"]
+            )
+        retrieved = vector_db.similarity_search_with_score(
+            question["question"], k=int(os.getenv("TOP_K", 5)), filter=metadata_filter
+        )
+        retrieved_sources = {
+            f"{doc.metadata.get('parent_folder', '')}/{os.path.basename(doc.metadata.get('source', ''))}"
+            for doc, _score in retrieved
+        }
+        if retrieved_sources & set(question["sources"]):
+            n_hits += 1
+        n_prompt_tokens += count_tokens(
+            build_prompt(query_text=question["question"], results=retrieved)
+        )
+
+    return {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "n_chunks": n_chunks,
+        "index_size_mb": round(_get_directory_size(persist_dir) / 2**20, 2),
+        "ingest_time_s": round(ingest_time, 2),
+        "hit_rate": round(n_hits / len(questions), 3) if questions else None,
+        "avg_prompt_tokens": (
+            round(n_prompt_tokens / len(questions)) if questions else None
+        ),
+    }
+
+
+def _get_directory_size(path: str) -> int:
+    """Returns the total size (bytes) of the files in a directory."""
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _dirs, files in os.walk(path)
+        for file in files
+    )
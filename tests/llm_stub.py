@@ -0,0 +1,95 @@
+"""
+Stub of the OpenAI chat completions API, which injects latency and errors. It is used to test the LLM client
+(retries, deadline, hedging, rate limit) without calling OpenAI.
+
+It can also be run manually, e.g. to try the app under a slow or failing provider:
+
+    STUB_LATENCY=2 STUB_ERROR_RATE=0.3 poetry run python tests/llm_stub.py
+
+and set OPENAI_BASE_URL="http://localhost:8001/v1" in the '.env' file.
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    script: Optional[List[Tuple[float, int]]] = None,
+) -> FastAPI:
+    """
+    Creates the stub server.
+
+    Args:
+        latency (float, optional): Latency of each response, in seconds. Defaults to 0.
+        error_rate (float, optional): Fraction of requests that fail. Defaults to 0.
+        error_status (int, optional): HTTP status of the failed requests (e.g., 429 or 500). Defaults to 500.
+        script (Optional[List[Tuple[float, int]]], optional): (latency, status) of the first requests, in order.
+            The next requests use latency, error_rate and error_status. Defaults to None.
+
+    Returns:
+        FastAPI: the stub app. app.state.requests holds the time at which each request was received.
+    """
+    app = FastAPI()
+    app.state.requests = []
+    script = list(script or [])
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests.append(time.monotonic())
+        n_request = len(app.state.requests)
+
+        if script:
+            request_latency, status = script.pop(0)
+        else:
+            request_latency = latency
+            status = error_status if random.random() < error_rate else 200
+        await asyncio.sleep(request_latency)
+
+        if status != 200:
+            return JSONResponse(
+                status_code=status,
+                content={"error": {"message": f"Stub error {status}", "type": "stub"}},
+                headers={"retry-after": "0"} if status == 429 else None,
+            )
+        return {
+            "id": f"chatcmpl-stub-{n_request}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": f"Stub answer {n_request}",
+                    },
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        create_app(
+            latency=float(os.getenv("STUB_LATENCY", 0)),
+            error_rate=float(os.getenv("STUB_ERROR_RATE", 0)),
+            error_status=int(os.getenv("STUB_ERROR_STATUS", 500)),
+        ),
+        host="0.0.0.0",
+        port=int(os.getenv("STUB_PORT", 8001)),
+    )
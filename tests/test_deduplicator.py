@@ -0,0 +1,44 @@
+from langchain_core.documents import Document
+
+from src.modules.rag.deduplicator import Deduplicator
+
+TEXT = (
+    "Checked bags must not weigh more than 50 pounds and must not exceed 62 linear inches. "
+    "Overweight and oversize bags are subject to additional fees, depending on the destination."
+)
+
+
+def make_chunk(source: str, order: int, text: str = TEXT) -> Document:
+    return Document(
+        page_content=text,
+        metadata={
+            "source": f"/data/Delta/{source}",
+            "parent_folder": "Delta",
+            "order": order,
+        },
+    )
+
+
+def test_duplicates_of_indexed_chunks_are_skipped():
+    indexed_chunk = Document(
+        page_content=TEXT, metadata={"id": "Delta/a.md:0", "aliases": "Delta/c.md:0"}
+    )
+    deduplicator = Deduplicator(load_indexed_chunks=lambda airline: [indexed_chunk])
+
+    documents = deduplicator.deduplicate(documents=[[make_chunk("b.md", 0)]])
+
+    assert documents == []
+    assert deduplicator.pop_late_aliases() == {
+        "Delta/a.md:0": {"aliases": "Delta/c.md:0,Delta/b.md:0"}
+    }
+
+
+def test_indexed_chunks_uploaded_again_are_kept():
+    indexed_chunk = Document(page_content=TEXT, metadata={"id": "Delta/a.md:0"})
+    deduplicator = Deduplicator(load_indexed_chunks=lambda airline: [indexed_chunk])
+
+    documents = deduplicator.deduplicate(documents=[[make_chunk("a.md", 0)]])
+
+    assert [chunk.metadata["order"] for doc in documents for chunk in doc] == [0]
+    assert deduplicator.n_duplicates == 0
+    assert deduplicator.pop_late_aliases() == {}
@@ -0,0 +1,116 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+from src.modules.rag.llm_client import LLMClient, LLMUnavailableError, ResponseCache
+from tests.llm_stub import create_app
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    """Starts a stub server created with the given arguments. Returns its app (to inspect the requests) and its URL."""
+    monkeypatch.setenv("OPENAI_API_KEY", "stub-key")
+    servers = []
+
+    def start(**kwargs):
+        app = create_app(**kwargs)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = uvicorn.Server(
+            uvicorn.Config(
+                app,
+                host="127.0.0.1",
+                port=port,
+                log_level="warning",
+                lifespan="off",
+                timeout_graceful_shutdown=1,
+            )
+        )
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+        servers.append((server, thread))
+        return app, f"http://127.0.0.1:{port}/v1"
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        server.force_exit = True
+        thread.join(timeout=5)
+
+
+def make_client(base_url: str, **kwargs) -> LLMClient:
+    kwargs = {"backoff_base": 0.01, "backoff_max": 0.05, **kwargs}
+    return LLMClient(model="stub", base_url=base_url, **kwargs)
+
+
+def test_retries_rate_limit_and_server_errors(stub_server):
+    app, base_url = stub_server(script=[(0, 429), (0, 500)])
+    client = make_client(base_url, max_retries=3)
+
+    assert client.invoke("question") == "Stub answer 3"
+    assert len(app.state.requests) == 3
+
+
+def test_raises_after_max_retries(stub_server):
+    app, base_url = stub_server(error_rate=1.0, error_status=500)
+    client = make_client(base_url, max_retries=2)
+
+    with pytest.raises(LLMUnavailableError):
+        client.invoke("question")
+    assert len(app.state.requests) == 3
+
+
+def test_deadline_stops_slow_requests(stub_server):
+    app, base_url = stub_server(latency=2.0)
+    client = make_client(base_url, timeout=10, deadline=0.5)
+
+    start = time.monotonic()
+    with pytest.raises(LLMUnavailableError):
+        client.invoke("question")
+    assert time.monotonic() - start < 1.5
+    assert len(app.state.requests) == 1
+
+
+def test_hedged_request_answers_first(stub_server):
+    app, base_url = stub_server(script=[(2.0, 200)])
+    client = make_client(base_url, hedging=True, hedge_min_samples=5)
+    client.latencies.extend([0.05] * 5)
+
+    start = time.monotonic()
+    assert client.invoke("question") == "Stub answer 2"
+    assert time.monotonic() - start < 1.5
+    assert len(app.state.requests) == 2
+
+
+def test_hedged_request_respects_rate_limit(stub_server):
+    app, base_url = stub_server(script=[(1.0, 200)])
+    # The bucket only has tokens for the first request
+    client = make_client(
+        base_url, hedging=True, hedge_min_samples=5, tokens_per_minute=600
+    )
+    client.latencies.extend([0.05] * 5)
+
+    assert client.invoke("question") == "Stub answer 1"
+    assert len(app.state.requests) == 1
+
+
+def test_response_cache_evicts_oldest_and_expired_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60, max_entries=2)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, f"response {key}")
+        # Distinct modification times, oldest first
+        os.utime(tmp_path / f"{key}.json", (time.time() - 10 + i, time.time() - 10 + i))
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "response b"
+    assert cache.get("c") == "response c"
+
+    os.utime(tmp_path / "b.json", (time.time() - 120, time.time() - 120))
+    assert cache.get("b") is None
@@ -0,0 +1,115 @@
+import openai
+import pytest
+
+import src.modules.rag.query_condenser as query_condenser_module
+from src.modules.rag.query_condenser import QueryCondenser
+from src.services import query_service
+
+AIRLINES = ["AmericanAirlines", "Delta", "United"]
+MEMORY = [{"question": "How much is the first checked bag on Delta?", "answer": "$35."}]
+
+
+@pytest.mark.parametrize(
+    "question, standalone_question",
+    [
+        ("What about United?", "How much is the first checked bag on United?"),
+        (
+            "And for American Airlines?",
+            "How much is the first checked bag on American Airlines?",
+        ),
+        (
+            "What about for pets?",
+            "How much is the first checked bag on Delta for pets?",
+        ),
+        (
+            "Is it refundable?",
+            "Is it refundable? (follow-up to: How much is the first checked bag on Delta?)",
+        ),
+    ],
+)
+def test_rules_rewrite_follow_ups(question, standalone_question):
+    condenser = QueryCondenser(mode="rules")
+
+    assert (
+        condenser.condense(question, MEMORY, airlines=AIRLINES) == standalone_question
+    )
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Why?",
+        "Is that refundable?",
+        "What about the second one?",
+        "What is the carry-on size on United?",
+        "What about pets on United?",
+    ],
+)
+def test_rules_leave_other_questions_unchanged(question):
+    condenser = QueryCondenser(mode="rules")
+
+    assert condenser.condense(question, MEMORY, airlines=AIRLINES) == question
+
+
+def test_rules_complete_follow_ups_with_last_standalone_question():
+    condenser = QueryCondenser(mode="rules")
+    memory = MEMORY + [{"question": "What about United?", "answer": "$40."}]
+
+    assert (
+        condenser.condense("And for American Airlines?", memory, airlines=AIRLINES)
+        == "How much is the first checked bag on American Airlines?"
+    )
+
+
+def test_llm_errors_fall_back_to_rules(monkeypatch):
+    class FailingLLM:
+        def invoke(self, prompt):
+            raise openai.OpenAIError("The model does not exist.")
+
+    monkeypatch.setattr(
+        query_condenser_module, "get_llm_client", lambda model: FailingLLM()
+    )
+    condenser = QueryCondenser(mode="llm", model="unknown-model")
+
+    assert (
+        condenser.condense("What about United?", MEMORY, airlines=AIRLINES)
+        == "How much is the first checked bag on United?"
+    )
+
+
+class FakeVectorDB:
+    def __init__(self, persist_dir=None):
+        pass
+
+    def list_airlines(self):
+        return AIRLINES
+
+    def similarity_search_with_score(self, query, k, filter=None):
+        return []
+
+
+class FakeLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return "Answer"
+
+
+@pytest.mark.parametrize(
+    "question, keeps_memory",
+    [("Why?", True), ("What about United?", False)],
+)
+def test_memory_is_kept_unless_question_is_rewritten(
+    monkeypatch, question, keeps_memory
+):
+    llm = FakeLLM()
+    monkeypatch.setattr(query_service, "VectorDB", FakeVectorDB)
+    monkeypatch.setattr(query_service, "get_llm_client", lambda model: llm)
+    monkeypatch.setattr(query_service, "query_condenser", QueryCondenser(mode="rules"))
+    monkeypatch.setenv("RETRIEVAL_POSTPROCESSING", "False")
+
+    query_service.query_rag(query_text=question, memory=MEMORY)
+
+    assert (MEMORY[0]["question"] in llm.prompts[0]) == keeps_memory
@@ -0,0 +1,52 @@
+from langchain.schema.document import Document
+
+from src.modules.rag.retrieval_postprocessor import RetrievalPostProcessor
+
+
+def make_results(embeddings):
+    """Retrieved chunks named after their position, with increasing distances."""
+    return [
+        (
+            Document(page_content=f"chunk {i}", metadata={"id": str(i)}),
+            0.1 * i,
+            embedding,
+        )
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def test_mmr_selects_diverse_candidate_after_top_k():
+    # 5 near-duplicates of the best chunk, then a relevant chunk about another aspect of the query
+    embeddings = [[1.0, 0.001 * i, 0.0] for i in range(5)] + [[0.8, 0.0, 0.6]]
+    postprocessor = RetrievalPostProcessor(
+        k=5, relative_threshold=0.5, mmr_lambda=0.7, redundancy_threshold=0.95
+    )
+
+    selected = postprocessor.process(
+        query_embedding=[1.0, 0.0, 0.3], results=make_results(embeddings)
+    )
+
+    assert [doc.metadata["id"] for doc, _ in selected] == ["0", "5"]
+
+
+def test_at_most_k_chunks_are_selected():
+    embeddings = [[1.0, 0.1 * i] for i in range(10)]
+    postprocessor = RetrievalPostProcessor(k=3)
+
+    selected = postprocessor.process(
+        query_embedding=[1.0, 0.0], results=make_results(embeddings)
+    )
+
+    assert [doc.metadata["id"] for doc, _ in selected] == ["0", "1", "2"]
+
+
+def test_cuts_apply_to_all_candidates():
+    # Only the first 2 candidates are within the relative threshold
+    embeddings = [[1.0, 0.0], [0.95, 0.05], [0.0, 1.0], [0.1, 1.0]]
+    postprocessor = RetrievalPostProcessor(k=3, relative_threshold=0.8)
+
+    selected = postprocessor.process(
+        query_embedding=[1.0, 0.0], results=make_results(embeddings)
+    )
+
+    assert [doc.metadata["id"] for doc, _ in selected] == ["0", "1"]